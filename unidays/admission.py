@@ -0,0 +1,94 @@
+from threading import Lock
+
+class AdmissionTicket:
+    def __init__(self, controller, laneName, cost):
+        # ==== PROTECTED PROPERTIES ====
+        self._controller = controller
+        self._released = False
+
+        # ==== PUBLIC PROPERTIES ====
+        self.laneName = laneName
+        self.cost = cost
+
+    # ==== PUBLIC METHODS ====
+    def Release(self):
+        """
+        Returns the ticket's capacity to its lane. Releasing twice has
+        no effect.
+        """
+        if not self._released:
+            self._released = True
+            self._controller.Release(self)
+
+class AdmissionController:
+    def __init__(self, lanes, oversizedThreshold, maxQueueWait=None):
+        # ==== PROTECTED PROPERTIES ====
+        # limits for each lane: maxInFlight requests, maxCost in-flight cost and retryAfter seconds
+        self._lanes = lanes
+        # cost at which a request is routed to the oversized lane
+        self._oversizedThreshold = oversizedThreshold
+        # longest time in seconds a request may have queued before reaching the app, None for no limit
+        self._maxQueueWait = maxQueueWait
+        self._lock = Lock()
+
+        # ==== PUBLIC PROPERTIES ====
+        # current in-flight requests and cost for each lane
+        self.inFlight = {laneName: 0 for laneName in lanes}
+        self.inFlightCost = {laneName: 0 for laneName in lanes}
+
+    # ==== PROTECTED METHODS ====
+    def _HasCapacity(self, laneName, cost):
+        """
+        Checks whether a lane can take on a request of the given cost.
+        """
+        lane = self._lanes[laneName]
+        if self.inFlight[laneName] >= lane['maxInFlight']:
+            return False
+        return self.inFlightCost[laneName] + cost <= lane['maxCost']
+
+    # ==== PUBLIC METHODS ====
+    def Lane(self, cost):
+        """
+        Returns the name of the lane a request of the given cost runs in.
+        """
+        return 'oversized' if cost >= self._oversizedThreshold else 'standard'
+
+    def Admissible(self, cost):
+        """
+        Checks whether a request of the given cost fits its lane's budget
+        at all. Requests that do not are never admitted and should be
+        rejected rather than retried.
+        """
+        return cost <= self._lanes[self.Lane(cost)]['maxCost']
+
+    def RetryAfter(self, cost):
+        """
+        Returns the number of seconds a shed request should wait before
+        retrying.
+        """
+        return self._lanes[self.Lane(cost)]['retryAfter']
+
+    def Admit(self, cost, queueWait=0):
+        """
+        Admits a request of the given cost and returns its ticket, or
+        returns None if its lane is full or it has already queued too long
+        in front of the app and the request should be shed.
+        """
+        laneName = self.Lane(cost)
+        if self._maxQueueWait is not None and queueWait > self._maxQueueWait:
+            return None
+        with self._lock:
+            if not self._HasCapacity(laneName, cost):
+                return None
+            self.inFlight[laneName] += 1
+            self.inFlightCost[laneName] += cost
+        return AdmissionTicket(self, laneName, cost)
+
+    def Release(self, ticket):
+        """
+        Removes a ticket's request from its lane's in-flight work. Use
+        AdmissionTicket.Release rather than calling this directly.
+        """
+        with self._lock:
+            self.inFlight[ticket.laneName] -= 1
+            self.inFlightCost[ticket.laneName] -= ticket.cost
@@ -0,0 +1,141 @@
+from copy import deepcopy
+from itertools import chain, repeat
+
+from unidays import UnidaysDiscountChallenge, Delivery
+from unidays_run import RunUnidays
+
+class BasketIndex:
+    def __init__(self, pricingRules, deliveryRules):
+        # ==== PROTECTED PROPERTIES ====
+        # private copy of the rules so that rule changes go through UpdateRule
+        self._pricingRules = dict(pricingRules)
+        self._deliveryRules = deliveryRules
+        self._delivery = Delivery(self._deliveryRules)
+        # stored baskets keyed by basket id, each holding its quantities and priced response
+        self._baskets = {}
+        # ids of the baskets that contain each item
+        self._itemIndex = {}
+
+    # ==== PROTECTED METHODS ====
+    def _PriceItem(self, item, quantity):
+        """
+        Prices a quantity of a single item through the reference classes
+        and returns its basket line and errors.
+        """
+        checkout = UnidaysDiscountChallenge(self._pricingRules, self._deliveryRules)
+        res = RunUnidays(checkout, repeat(item, quantity)).All()
+        return {'line': res['Basket'].get(item), 'errors': res.get('Errors', {}).get(item)}
+
+    def _PriceBasket(self, quantities):
+        """
+        Prices a basket's quantities in full through the reference classes.
+        """
+        checkout = UnidaysDiscountChallenge(self._pricingRules, self._deliveryRules)
+        return RunUnidays(checkout, chain.from_iterable(repeat(item, quantity) for item, quantity in quantities.items())).All()
+
+    def _Incremental(self, res, *contributions):
+        """
+        Checks whether a priced basket can be updated by removing and
+        adding item contributions, which is only exact when every amount
+        involved is an integer.
+        """
+        amounts = [res['Total'], res['Savings']]
+        for contribution in contributions:
+            if contribution['line']:
+                amounts += [contribution['line']['finalCost'], contribution['line']['itemSavings']]
+        return all(type(amount) is int for amount in amounts)
+
+    def _ApplyContribution(self, res, item, contribution, sign):
+        """
+        Adds (sign 1) or removes (sign -1) an item's contribution to a
+        priced basket.
+        """
+        if contribution['line']:
+            res['Total'] += sign * contribution['line']['finalCost']
+            res['Savings'] += sign * contribution['line']['itemSavings']
+            if sign > 0:
+                res['Basket'][item] = contribution['line']
+            else:
+                del res['Basket'][item]
+        if contribution['errors']:
+            if sign > 0:
+                res.setdefault('Errors', {})[item] = contribution['errors']
+            else:
+                del res['Errors'][item]
+                if not res['Errors']:
+                    del res['Errors']
+
+    def _UpdateDeliveryCharge(self, res):
+        """
+        Recalculates the delivery charge, which stays at 0 until a valid
+        item is in the basket.
+        """
+        if res['Basket']:
+            res['DeliveryCharge'] = self._delivery.CalculateDeliveryPrice(res['Total'])
+        else:
+            res['DeliveryCharge'] = 0
+
+    # ==== PUBLIC METHODS ====
+    def StoreBasket(self, basketId, itemsToAdd):
+        """
+        Prices a basket in full and stores it with its per-item
+        contributions, replacing any basket with the same id.
+        """
+        self.RemoveBasket(basketId)
+        itemsToAdd = list(itemsToAdd)
+        quantities = {}
+        for item in itemsToAdd:
+            quantities[item] = quantities.get(item, 0) + 1
+        checkout = UnidaysDiscountChallenge(self._pricingRules, self._deliveryRules)
+        res = RunUnidays(checkout, itemsToAdd).All()
+        self._baskets[basketId] = {'quantities': quantities, 'res': res}
+        for item in quantities:
+            self._itemIndex.setdefault(item, set()).add(basketId)
+        return deepcopy(res)
+
+    def RemoveBasket(self, basketId):
+        """
+        Removes a stored basket from the index.
+        """
+        if basketId in self._baskets:
+            for item in self._baskets.pop(basketId)['quantities']:
+                self._itemIndex[item].discard(basketId)
+                if not self._itemIndex[item]:
+                    del self._itemIndex[item]
+
+    def Price(self, basketId):
+        """
+        Returns the current pricing of a stored basket, or None if the
+        basket id is unknown.
+        """
+        if basketId in self._baskets:
+            return deepcopy(self._baskets[basketId]['res'])
+
+    def UpdateRule(self, item, itemPricingRules):
+        """
+        Replaces the pricing rules for an item (None removes them) and
+        re-prices only the stored baskets containing that item. Returns
+        the ids of the re-priced baskets.
+        """
+        if itemPricingRules is None:
+            self._pricingRules.pop(item, None)
+        else:
+            self._pricingRules[item] = itemPricingRules
+        affectedBaskets = self._itemIndex.get(item, set())
+        # baskets holding the same quantity share a single new contribution
+        newContributions = {}
+        for basketId in affectedBaskets:
+            basket = self._baskets[basketId]
+            res = basket['res']
+            quantity = basket['quantities'][item]
+            oldContribution = {'line': res['Basket'].get(item), 'errors': res.get('Errors', {}).get(item)}
+            if quantity not in newContributions:
+                newContributions[quantity] = self._PriceItem(item, quantity)
+            # float and non-finite amounts do not cancel out exactly, so such baskets are re-priced in full
+            if not self._Incremental(res, oldContribution, newContributions[quantity]):
+                basket['res'] = self._PriceBasket(basket['quantities'])
+                continue
+            self._ApplyContribution(res, item, oldContribution, -1)
+            self._ApplyContribution(res, item, deepcopy(newContributions[quantity]), 1)
+            self._UpdateDeliveryCharge(res)
+        return set(affectedBaskets)
@@ -0,0 +1,57 @@
+import codecs
+from collections import Counter
+from itertools import chain, repeat
+
+# characters that separate items in a bulk order body rather than being items themselves
+_separators = str.maketrans('', '', ' \t\r\n')
+
+class BulkOrderReader:
+    def __init__(self, stream, maxBytes, chunkBytes):
+        # ==== PROTECTED PROPERTIES ====
+        self._stream = stream
+        # largest body that will be accepted
+        self._maxBytes = maxBytes
+        # number of bytes read from the stream at a time
+        self._chunkBytes = chunkBytes
+        # decodes UTF-8 characters that are split across chunks
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._tally = Counter()
+
+        # ==== PUBLIC PROPERTIES ====
+        self.bytesRead = 0
+        self.quantities = {}
+
+    # ==== PROTECTED METHODS ====
+    def _TallyChunk(self, chunk):
+        """
+        Adds the items in a chunk of the body to the tally.
+        """
+        self._tally.update(self._decoder.decode(chunk).translate(_separators).upper())
+
+    # ==== PUBLIC METHODS ====
+    def Read(self):
+        """
+        Reads the body chunk by chunk and tallies its items, keeping only
+        the tally in memory. Returns False as soon as the body exceeds the
+        size cap.
+        """
+        while True:
+            chunk = self._stream.read(self._chunkBytes)
+            if not chunk:
+                break
+            self.bytesRead += len(chunk)
+            if self.bytesRead > self._maxBytes:
+                return False
+            self._TallyChunk(chunk)
+        # flush any incomplete character left at the end of the body
+        self._tally.update(self._decoder.decode(b'', final=True).translate(_separators).upper())
+        # each character of the body is one item
+        self.quantities = dict(self._tally)
+        return True
+
+    def Items(self):
+        """
+        Returns the tallied items one unit at a time without building
+        the full list of items.
+        """
+        return chain.from_iterable(repeat(item, quantity) for item, quantity in self.quantities.items())
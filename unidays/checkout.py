@@ -1,7 +1,15 @@
-from unidays import UnidaysDiscountChallenge
-from config import pricingRules, deliveryRules
+from registry import RulesRegistry
+from snapshot import LoadSnapshot
 from unidays_run import RunUnidays
 from utils import userInputs, errors
+from config_api import ruleSetSources, registrySettings, snapshotSettings
+
+# load the default rule set, precompiled from the snapshot if one has been built
+rulesRegistry = RulesRegistry(ruleSetSources, registrySettings['maxSize'], registrySettings['rulesDirectory'])
+snapshotRuleSets = LoadSnapshot(snapshotSettings['path'], rulesRegistry)
+ruleSet = rulesRegistry.Get(registrySettings['defaultRuleset'])
+# use the snapshot's compiled engine, otherwise the reference classes
+engine = ruleSet.Engine('compiled') if snapshotRuleSets else None
 
 # initialize userInput
 userInput = None
@@ -16,9 +24,9 @@ while not userInput == '2':
     elif userInput == '1':
         itemsToAdd = list(str(input(userInputs['items'])).upper())
         # create a new instance of UnidaysDiscountChallenge
-        checkout = UnidaysDiscountChallenge(pricingRules,deliveryRules)
+        checkout = ruleSet.Checkout()
         # create a new instance of RunUnidays
-        run = RunUnidays(checkout, itemsToAdd)
+        run = RunUnidays(checkout, itemsToAdd, engine)
         # print the response from RunUnidays
         print(run.All())
      
\ No newline at end of file
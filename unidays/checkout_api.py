@@ -1,15 +1,127 @@
-from flask import Flask, Response, request
+import time
+bootStarted = time.perf_counter()
+
+from flask import Flask, Response, request, g
 from flask_cors import CORS
 
-from unidays import UnidaysDiscountChallenge
-from config import pricingRules, deliveryRules
+from registry import RulesRegistry, RuleSetError
 from unidays_run import RunUnidays
-from config_api import errors, statusCodes
+from bulk import BulkOrderReader
+from admission import AdmissionController
+from snapshot import LoadSnapshot
+from wire import WireFormatError, DecodeBasket, EncodeTotals, basketContentType, totalsContentType
+from config_api import errors, statusCodes, ruleSetSources, registrySettings, bulkSettings, admissionSettings, snapshotSettings
 
 # create Flask app
 app = Flask(__name__)
 # enable CORS
 CORS(app)
+# create the registry that lazily loads the rule set for each storefront
+rulesRegistry = RulesRegistry(ruleSetSources, registrySettings['maxSize'], registrySettings['rulesDirectory'])
+# preload the precompiled rule sets if a snapshot has been built
+snapshotRuleSets = LoadSnapshot(snapshotSettings['path'], rulesRegistry)
+# load and compile the other known rule sets up front so that no request waits for them
+for rulesetId in rulesRegistry.Known()[:registrySettings['maxSize']]:
+    try:
+        rulesRegistry.Get(rulesetId)
+    except RuleSetError:
+        # malformed rules files are reported to the requests that use them
+        pass
+# create the admission controller that sheds pricing requests under overload
+admissionController = AdmissionController(admissionSettings['lanes'], admissionSettings['oversizedThreshold'], admissionSettings['maxQueueWait'])
+
+# report the cold-start time so that slow boots show up in the logs
+print('Pricing app ready in {:.1f}ms ({})'.format(
+    (time.perf_counter() - bootStarted) * 1000,
+    '{} rule sets from snapshot'.format(len(snapshotRuleSets)) if snapshotRuleSets is not None else 'no snapshot'), flush=True)
+
+# ==== ADMISSION CONTROL ====
+"""
+Every pricing request is admitted against an estimate of its cost before 
+it runs. Baskets at or over admissionSettings['oversizedThreshold'] run in 
+a separate oversized lane so they cannot crowd out normal carts. The 
+lanes admit fewer requests than there are worker threads, so spare threads 
+shed requests rather than leaving them queued. When a lane is full, or a 
+request has already waited longer than admissionSettings['maxQueueWait'] 
+since the router's X-Request-Start, the request is shed with:
+    Failure (status 503, Retry-After header set):
+    {
+        "Message": "ERROR: The server is too busy to price this basket. 
+        Please retry after the number of seconds in the Retry-After header."
+    }
+Requests whose estimated cost is over the oversized lane's maxCost, or 
+bodies sent without a Content-Length that could be, are rejected with 
+status 413. Oversized baskets are always priced with the compiled engine.
+Limits apply per worker process.
+"""
+def estimate_cost():
+    # a small packed body can ask for any number of units, so it costs the larger of its units and bytes
+    if request.endpoint == 'calculate_packed_price':
+        # decoded once here and kept for the endpoint
+        try:
+            g.packedBasket = DecodeBasket(request.get_data())
+        except WireFormatError:
+            g.packedBasket = None
+            return request.content_length
+        return max(sum(g.packedBasket.quantities.values()), request.content_length)
+    # a streamed body without a declared size may be as large as the cap
+    if request.content_length is None:
+        return bulkSettings['maxBodyBytes']
+    # otherwise each byte of the body is roughly one item
+    return request.content_length or 0
+
+def queue_wait():
+    # the router stamps X-Request-Start in milliseconds since the epoch when the request arrives
+    requestStart = request.headers.get('X-Request-Start', '')
+    try:
+        return max(time.time() - float(requestStart) / 1000, 0)
+    except ValueError:
+        return 0
+
+@app.before_request
+def admit_request():
+    if request.endpoint not in ('calculate_price', 'calculate_bulk_price', 'calculate_packed_price'):
+        return None
+    # packed bodies are read whole, so check their declared size before reading them
+    if request.endpoint == 'calculate_packed_price':
+        if request.content_length is None:
+            return ({'Message': str(errors['lengthRequired'])}, statusCodes['lengthRequired'])
+        if request.content_length > bulkSettings['maxBodyBytes']:
+            return ({'Message': str(errors['bodyTooLarge'])}, statusCodes['payloadTooLarge'])
+    cost = estimate_cost()
+    # requests over the largest lane budget would never be admitted, so reject them outright
+    if not admissionController.Admissible(cost):
+        error = errors['tooManyUnits'] if request.endpoint == 'calculate_packed_price' else errors['bodyTooLarge']
+        return ({'Message': str(error)}, statusCodes['payloadTooLarge'])
+    g.admissionTicket = admissionController.Admit(cost, queue_wait())
+    if g.admissionTicket is None:
+        return ({'Message': str(errors['overloaded'])}, statusCodes['serviceUnavailable'], {'Retry-After': str(admissionController.RetryAfter(cost))})
+
+def lane_engine(engineName):
+    # oversized baskets always run on the compiled engine so that they are priced per item rather than per unit
+    if g.admissionTicket.laneName == 'oversized':
+        return 'compiled'
+    return engineName
+
+@app.teardown_request
+def release_request(error=None):
+    ticket = g.pop('admissionTicket', None)
+    if ticket:
+        ticket.Release()
+
+# ==== RULESET ERRORS ====
+"""
+A ruleset whose rules file cannot be loaded fails every pricing request 
+for that storefront with:
+    Failure (status 500):
+    {
+        "Message": "ERROR: The requested ruleset could not be loaded because 
+        its rules file is malformed."
+    }
+"""
+@app.errorhandler(RuleSetError)
+def invalid_ruleset(error):
+    return ({'Message': str(errors['invalidRuleset'])}, statusCodes['serverError'])
 
 # ==== SANITY CHECK ENDPOINT ====
 """
@@ -35,7 +147,9 @@ def server_check():
 @path: '/price'
 @params: none
 @query: none
-@body: {"items": "bbbbccccz"}
+@body: {"items": "bbbbccccz", "ruleset": "default", "engine": "compiled"}
+    (ruleset is optional and defaults to the default storefront, engine is 
+    optional and is either reference or compiled, defaulting to reference)
 @responses: 
     Success (status 200)
     {
@@ -71,6 +185,15 @@ def server_check():
         Please provide a JSON body with an items key and list of items e.g. 
         {items: abc}."
     }
+    Failure (status 400):
+    {
+        "Message": "ERROR: The requested engine does not exist. Please use 
+        reference or compiled."
+    }
+    Failure (status 404):
+    {
+        "Message": "ERROR: The requested ruleset does not exist."
+    }
 """
 @app.route('/price', methods=['POST'])
 def calculate_price():
@@ -81,12 +204,153 @@ def calculate_price():
         return ({'Message': str(errors['noItemsKey'])}, statusCodes['badRequest'])
     # format the items to a capitalized list
     itemsToAdd = list(str(itemsSubmitted['items']).upper())
+    # look up the rule set for the requested storefront
+    ruleSet = rulesRegistry.Get(str(itemsSubmitted.get('ruleset', registrySettings['defaultRuleset'])))
+    if ruleSet is None:
+        return ({'Message': str(errors['unknownRuleset'])}, statusCodes['notFound'])
+    # check the requested engine exists
+    engineName = str(itemsSubmitted.get('engine', registrySettings['defaultEngine']))
+    if engineName not in registrySettings['engines']:
+        return ({'Message': str(errors['unknownEngine'])}, statusCodes['badRequest'])
     # create a new instance of UnidaysDiscountChallenge
-    checkout = UnidaysDiscountChallenge(pricingRules,deliveryRules)
+    checkout = ruleSet.Checkout()
     # create a new instance of RunUnidays
-    run = RunUnidays(checkout, itemsToAdd)
+    run = RunUnidays(checkout, itemsToAdd, ruleSet.Engine(lane_engine(engineName)))
+    # return the response from RunUnidays
+    return (run.All(), statusCodes['success'])
+
+# ==== BULK PRICE ENDPOINT ====
+"""
+@method: [POST]
+@path: '/price/bulk'
+@params: none
+@query: ruleset (optional, defaults to the default storefront), engine 
+    (optional, reference or compiled, defaults to reference)
+@body: raw item characters e.g. bbbbccccz (whitespace is ignored)
+@responses:
+    Success (status 200): same as '/price'
+    Failure (status 400):
+    {
+        "Message": "ERROR: The requested engine does not exist. Please use 
+        reference or compiled."
+    }
+    Failure (status 404):
+    {
+        "Message": "ERROR: The requested ruleset does not exist."
+    }
+    Failure (status 413):
+    {
+        "Message": "ERROR: The request body is larger than the maximum bulk 
+        order size."
+    }
+"""
+@app.route('/price/bulk', methods=['POST'])
+def calculate_bulk_price():
+    # reject bodies that declare a size over the cap before reading them
+    if request.content_length is not None and request.content_length > bulkSettings['maxBodyBytes']:
+        return ({'Message': str(errors['bodyTooLarge'])}, statusCodes['payloadTooLarge'])
+    # look up the rule set for the requested storefront
+    ruleSet = rulesRegistry.Get(request.args.get('ruleset', registrySettings['defaultRuleset']))
+    if ruleSet is None:
+        return ({'Message': str(errors['unknownRuleset'])}, statusCodes['notFound'])
+    # check the requested engine exists
+    engineName = request.args.get('engine', registrySettings['defaultEngine'])
+    if engineName not in registrySettings['engines']:
+        return ({'Message': str(errors['unknownEngine'])}, statusCodes['badRequest'])
+    # tally the items as the body streams in
+    reader = BulkOrderReader(request.stream, bulkSettings['maxBodyBytes'], bulkSettings['chunkBytes'])
+    if not reader.Read():
+        return ({'Message': str(errors['bodyTooLarge'])}, statusCodes['payloadTooLarge'])
+    # the compiled engine prices the tally directly
+    engine = ruleSet.Engine(lane_engine(engineName))
+    if engine:
+        return (engine.Price(reader.quantities), statusCodes['success'])
+    # create a new instance of RunUnidays fed one unit at a time from the tally
+    run = RunUnidays(ruleSet.Checkout(), reader.Items())
     # return the response from RunUnidays
     return (run.All(), statusCodes['success'])
 
+# ==== PACKED PRICE ENDPOINT ====
+"""
+@method: [POST]
+@path: '/price/packed'
+@params: none
+@query: engine (optional, reference or compiled, defaults to reference)
+@body: application/x-unidays-basket (see wire.py), e.g. built with 
+    wire_client.PricingClient
+@responses:
+    Success (status 200): application/x-unidays-totals with the same totals, 
+    basket lines and error codes as '/price'
+    Failure (status 400):
+    {
+        "Message": "ERROR: An incorrect packed basket was passed with the 
+        request. Please provide a body in the application/x-unidays-basket 
+        format."
+    }
+    Failure (status 400):
+    {
+        "Message": "ERROR: The requested engine does not exist. Please use 
+        reference or compiled."
+    }
+    Failure (status 404):
+    {
+        "Message": "ERROR: The requested ruleset does not exist."
+    }
+    Failure (status 411):
+    {
+        "Message": "ERROR: A packed basket must be sent with a Content-Length 
+        header."
+    }
+    Failure (status 413):
+    {
+        "Message": "ERROR: The request body is larger than the maximum bulk 
+        order size."
+    }
+    Failure (status 413):
+    {
+        "Message": "ERROR: The basket contains more units than the maximum 
+        bulk order size."
+    }
+    Failure (status 500), when the rule set has amounts that are neither 
+    integers nor floats:
+    {
+        "Message": "ERROR: The basket was priced but its amounts cannot be 
+        sent in the packed format. Please use the JSON /price endpoint."
+    }
+"""
+@app.route('/price/packed', methods=['POST'])
+def calculate_packed_price():
+    # check the body is declared as a packed basket
+    if request.mimetype != basketContentType:
+        return ({'Message': str(errors['invalidPackedBasket'])}, statusCodes['badRequest'])
+    # the basket was unpacked from the request body when the request was admitted
+    basket = g.packedBasket
+    if basket is None:
+        return ({'Message': str(errors['invalidPackedBasket'])}, statusCodes['badRequest'])
+    # a few bytes can ask for any quantity, so cap the units as the bulk path caps bytes
+    if sum(basket.quantities.values()) > bulkSettings['maxUnits']:
+        return ({'Message': str(errors['tooManyUnits'])}, statusCodes['payloadTooLarge'])
+    # look up the rule set for the requested storefront
+    ruleSet = rulesRegistry.Get(basket.rulesetId or registrySettings['defaultRuleset'])
+    if ruleSet is None:
+        return ({'Message': str(errors['unknownRuleset'])}, statusCodes['notFound'])
+    # check the requested engine exists
+    engineName = request.args.get('engine', registrySettings['defaultEngine'])
+    if engineName not in registrySettings['engines']:
+        return ({'Message': str(errors['unknownEngine'])}, statusCodes['badRequest'])
+    # the compiled engine prices the basket's quantities directly
+    engine = ruleSet.Engine(lane_engine(engineName))
+    if engine:
+        res = engine.Price(basket.quantities)
+    else:
+        # create a new instance of RunUnidays fed one unit at a time from the basket
+        res = RunUnidays(ruleSet.Checkout(), basket.Items()).All()
+    # return the packed response
+    try:
+        packedTotals = EncodeTotals(res)
+    except WireFormatError:
+        return ({'Message': str(errors['unpackableTotals'])}, statusCodes['serverError'])
+    return Response(packedTotals, status=statusCodes['success'], mimetype=totalsContentType)
+
 if __name__ == '__main__':
     app.run(port=8000)
@@ -1,8 +1,60 @@
 errors = {
     'noItemsKey': 'ERROR: An incorrect JSON body was passed with the request. Please provide a JSON body with an items key and list of items e.g. {items: abc}.',
+    'unknownRuleset': 'ERROR: The requested ruleset does not exist.',
+    'invalidRuleset': 'ERROR: The requested ruleset could not be loaded because its rules file is malformed.',
+    'invalidPackedBasket': 'ERROR: An incorrect packed basket was passed with the request. Please provide a body in the application/x-unidays-basket format.',
+    'unknownEngine': 'ERROR: The requested engine does not exist. Please use reference or compiled.',
+    'bodyTooLarge': 'ERROR: The request body is larger than the maximum bulk order size.',
+    'unpackableTotals': 'ERROR: The basket was priced but its amounts cannot be sent in the packed format. Please use the JSON /price endpoint.',
+    'tooManyUnits': 'ERROR: The basket contains more units than the maximum bulk order size.',
+    'lengthRequired': 'ERROR: A packed basket must be sent with a Content-Length header.',
+    'overloaded': 'ERROR: The server is too busy to price this basket. Please retry after the number of seconds in the Retry-After header.',
 }
 
 statusCodes = {
     'success': 200,
     'badRequest': 400,
+    'notFound': 404,
+    'lengthRequired': 411,
+    'payloadTooLarge': 413,
+    'serverError': 500,
+    'serviceUnavailable': 503,
+}
+
+ruleSetSources = {
+    'default': {'module': 'config', 'pricingRules': 'pricingRules', 'deliveryRules': 'deliveryRules'},
+    'alt': {'module': 'config_alt', 'pricingRules': 'pricingRulesAlt', 'deliveryRules': 'deliveryRulesAlt'},
+}
+
+registrySettings = {
+    'defaultRuleset': 'default',
+    'defaultEngine': 'reference',
+    'engines': ['reference', 'compiled'],
+    'maxSize': 256,
+    'rulesDirectory': 'rulesets',
+}
+
+bulkSettings = {
+    'maxBodyBytes': 256 * 1024 * 1024,
+    # largest packed basket, matching the number of items the largest bulk body can hold
+    'maxUnits': 256 * 1024 * 1024,
+    'chunkBytes': 64 * 1024,
+}
+
+admissionSettings = {
+    # estimated cost (items or body bytes) from which a basket runs in the oversized lane
+    'oversizedThreshold': 100000,
+    # the lanes together stay below the 16 gunicorn threads in the Procfile so that spare
+    # threads are always free to shed requests instead of leaving them queued in gunicorn
+    'lanes': {
+        'standard': {'maxInFlight': 12, 'maxCost': 400000, 'retryAfter': 1},
+        'oversized': {'maxInFlight': 1, 'maxCost': 256 * 1024 * 1024, 'retryAfter': 10},
+    },
+    # seconds a request may wait between the router (X-Request-Start) and the app before it is shed
+    'maxQueueWait': 0.5,
+}
+
+snapshotSettings = {
+    # versioned with snapshot.snapshotFormat, built by running python3 snapshot.py build
+    'path': 'pricing.v3.snapshot',
 }
@@ -0,0 +1,299 @@
+"""
+Differential fuzzing and scaling benchmarks for the pricing engines.
+
+Usage:
+    python3 engine_fuzz.py fuzz [iterations] [seed] [maxUnits]
+    python3 engine_fuzz.py bench [plot.png]
+"""
+import math
+import random
+import sys
+import time
+from itertools import chain, repeat
+
+from unidays_run import RunUnidays
+from registry import RuleSet
+from rules_compiler import Comparable
+from basket_index import BasketIndex
+from wire import WireFormatError, EncodeBasket, DecodeBasket, EncodeTotals, DecodeTotals
+
+class RuleSetGenerator:
+    def __init__(self, rng):
+        # ==== PROTECTED PROPERTIES ====
+        self._rng = rng
+
+    # ==== PROTECTED METHODS ====
+    def _Value(self, value):
+        """
+        Returns the value, or now and then a float, non-finite or wrongly
+        typed stand-in for it, as rule files written by hand may contain.
+        """
+        kind = self._rng.choices(['int', 'float', 'inf', '-inf', 'nan', 'string', 'bool'], weights=[80, 10, 2, 2, 2, 2, 2])[0]
+        if kind == 'int':
+            return value
+        if kind == 'float':
+            return self._rng.choice([float(value), value + 0.5, round(value * self._rng.random(), 2)])
+        if kind in ('inf', '-inf', 'nan'):
+            return float(kind)
+        if kind == 'string':
+            return str(value)
+        return self._rng.choice([True, False])
+
+    def _ItemRules(self):
+        """
+        Returns random pricing rules for one item, including the broken
+        rules the validators report.
+        """
+        price = self._rng.randint(0, 20)
+        discountFrequency = self._rng.choice([0, 1, 2, 3, 5, 30, self._rng.randint(2, 1000)])
+        # deals are usually cheaper than full price but not always
+        discountedPrice = self._Value(self._rng.randint(0, price * max(discountFrequency, 1) + 5))
+        price = self._Value(price)
+        discountFrequency = self._Value(discountFrequency)
+        kind = self._rng.choices(
+            ['notDiscountable', 'Discountable', 'noPrice', 'noStatus', 'noDiscountFrequency', 'noDiscountedPrice', 'noDiscountRules', 'unknownStatus'],
+            weights=[30, 40, 4, 6, 5, 5, 5, 1])[0]
+        if kind == 'notDiscountable':
+            return {'price': price, 'status': 'notDiscountable'}
+        if kind == 'Discountable':
+            return {'price': price, 'status': 'Discountable', 'discountFrequency': discountFrequency, 'discountedPrice': discountedPrice}
+        if kind == 'noPrice':
+            return {'status': self._rng.choice(['notDiscountable', 'Discountable'])}
+        if kind == 'noStatus':
+            return {'price': price}
+        if kind == 'noDiscountFrequency':
+            return {'price': price, 'status': 'Discountable', 'discountedPrice': discountedPrice}
+        if kind == 'noDiscountedPrice':
+            return {'price': price, 'status': 'Discountable', 'discountFrequency': discountFrequency}
+        if kind == 'noDiscountRules':
+            return {'price': price, 'status': 'Discountable'}
+        return {'price': price, 'status': 'clearance'}
+
+    # ==== PUBLIC METHODS ====
+    def Generate(self, itemCount):
+        """
+        Returns random pricing and delivery rules for the given number
+        of items.
+        """
+        pricingRules = {'S{}'.format(index): self._ItemRules() for index in range(itemCount)}
+        deliveryRules = {'standard': self._Value(self._rng.randint(0, 30)), 'freeThreshold': self._Value(self._rng.randint(0, 200))}
+        return pricingRules, deliveryRules
+
+class BasketGenerator:
+    def __init__(self, rng):
+        # ==== PROTECTED PROPERTIES ====
+        self._rng = rng
+
+    # ==== PUBLIC METHODS ====
+    def Generate(self, pricingRules, maxUnits):
+        """
+        Returns random item quantities, including items missing from the
+        pricing rules, totalling at most maxUnits.
+        """
+        items = list(pricingRules) + ['Z{}'.format(index) for index in range(3)]
+        # spread basket sizes evenly across orders of magnitude
+        units = int(10 ** self._rng.uniform(0, math.log10(maxUnits)))
+        quantities = {}
+        for item in self._rng.sample(items, self._rng.randint(0, len(items))):
+            if units <= 0:
+                break
+            quantities[item] = self._rng.randint(1, units)
+            units -= quantities[item]
+        return quantities
+
+# ==== ENGINES ====
+"""
+Each engine prices a basket of item quantities against a RuleSet and
+returns the same response as RunUnidays.All(). 'reference' is the
+per-unit Item/DiscountableItem path the others are checked against.
+"""
+def _Expand(quantities):
+    return chain.from_iterable(repeat(item, quantity) for item, quantity in quantities.items())
+
+def _ReferenceEngine(ruleSet, quantities):
+    return RunUnidays(ruleSet.Checkout(), _Expand(quantities)).All()
+
+def _CompiledEngine(ruleSet, quantities):
+    return ruleSet.Engine('compiled').Price(quantities)
+
+def _PackedEngine(ruleSet, quantities):
+    # prices through the packed wire format in both directions
+    basket = DecodeBasket(EncodeBasket(quantities))
+    res = _CompiledEngine(ruleSet, basket.quantities)
+    try:
+        return DecodeTotals(EncodeTotals(res))
+    except WireFormatError:
+        # amounts of other types, from malformed rules, are answered with errors['unpackableTotals']
+        amounts = [res['Total'], res['Savings'], res['DeliveryCharge']]
+        for line in res['Basket'].values():
+            amounts += [line['unitPrice'], line['itemSavings'], line['finalCost']]
+        if all(amount is None or isinstance(amount, (int, float)) for amount in amounts):
+            raise
+        return res
+
+def _BasketIndexEngine(ruleSet, quantities):
+    # stores the basket without the rules for one of its items, then applies them incrementally
+    if not quantities:
+        return _ReferenceEngine(ruleSet, quantities)
+    # the last item so that broken rules are hit in the same order as in the reference classes
+    item = list(quantities)[-1]
+    index = BasketIndex({key: value for key, value in ruleSet.pricingRules.items() if key != item}, ruleSet.deliveryRules)
+    index.StoreBasket('fuzz', list(_Expand(quantities)))
+    index.UpdateRule(item, ruleSet.pricingRules.get(item))
+    return index.Price('fuzz')
+
+engines = {
+    'reference': _ReferenceEngine,
+    'compiled': _CompiledEngine,
+    'packed': _PackedEngine,
+    'basketIndex': _BasketIndexEngine,
+}
+
+class DifferentialFuzzer:
+    def __init__(self, seed, maxUnits, maxItems=40, engineNames=None):
+        # ==== PROTECTED PROPERTIES ====
+        self._seed = seed
+        self._maxUnits = maxUnits
+        self._maxItems = maxItems
+        self._engineNames = engineNames or [name for name in engines if name != 'reference']
+
+    # ==== PROTECTED METHODS ====
+    def _Outcome(self, engine, ruleSet, quantities):
+        """
+        Returns an engine's response, or the type of the exception it raised.
+        """
+        try:
+            return Comparable(engine(ruleSet, quantities))
+        except Exception as error:
+            return type(error)
+
+    # ==== PUBLIC METHODS ====
+    def Run(self, iterations):
+        """
+        Prices random baskets against random rule sets through every
+        engine and returns the cases where an engine disagrees with the
+        reference classes.
+        """
+        mismatches = []
+        for iteration in range(iterations):
+            # each case has its own seed so that it can be replayed on its own
+            caseSeed = '{}:{}'.format(self._seed, iteration)
+            rng = random.Random(caseSeed)
+            pricingRules, deliveryRules = RuleSetGenerator(rng).Generate(rng.randint(1, self._maxItems))
+            quantities = BasketGenerator(rng).Generate(pricingRules, self._maxUnits)
+            ruleSet = RuleSet(caseSeed, pricingRules, deliveryRules)
+            expected = self._Outcome(engines['reference'], ruleSet, quantities)
+            for engineName in self._engineNames:
+                actual = self._Outcome(engines[engineName], ruleSet, quantities)
+                if actual != expected:
+                    mismatches.append({
+                        'seed': caseSeed,
+                        'engine': engineName,
+                        'pricingRules': pricingRules,
+                        'deliveryRules': deliveryRules,
+                        'quantities': quantities,
+                        'expected': expected,
+                        'actual': actual
+                    })
+        return mismatches
+
+class ScalingBenchmark:
+    def __init__(self, basketSizes, itemCounts, engineNames, seed=0):
+        # ==== PROTECTED PROPERTIES ====
+        self._basketSizes = basketSizes
+        self._itemCounts = itemCounts
+        self._engineNames = engineNames
+        self._seed = seed
+
+    # ==== PROTECTED METHODS ====
+    def _Basket(self, pricingRules, units):
+        """
+        Returns a basket of the given size spread evenly over the items.
+        """
+        items = list(pricingRules)
+        quantities = {item: units // len(items) for item in items}
+        quantities[items[0]] += units % len(items)
+        return quantities
+
+    def _Throughput(self, engine, ruleSet, quantities):
+        """
+        Returns the units priced per second, repeating small baskets
+        until the timing is meaningful.
+        """
+        runs = 0
+        started = time.perf_counter()
+        while True:
+            engine(ruleSet, quantities)
+            runs += 1
+            elapsed = time.perf_counter() - started
+            if elapsed > 0.2:
+                return sum(quantities.values()) * runs / elapsed
+
+    # ==== PUBLIC METHODS ====
+    def Run(self):
+        """
+        Returns the throughput of each engine for each item count and
+        basket size as {engineName: {itemCount: [(basketSize, unitsPerSecond)]}}.
+        """
+        results = {engineName: {} for engineName in self._engineNames}
+        for itemCount in self._itemCounts:
+            # valid, discountable rules so that every unit goes through the full pricing path
+            rng = random.Random(self._seed)
+            pricingRules = {'S{}'.format(index): {'price': rng.randint(1, 20), 'status': 'Discountable', 'discountFrequency': rng.randint(2, 5), 'discountedPrice': rng.randint(1, 20)} for index in range(itemCount)}
+            ruleSet = RuleSet('bench', pricingRules, {'standard': 7, 'freeThreshold': 50})
+            # compile once up front so that the compiled engine is timed from its cache
+            ruleSet.Engine('compiled')
+            for basketSize in self._basketSizes:
+                if basketSize < itemCount:
+                    continue
+                quantities = self._Basket(pricingRules, basketSize)
+                for engineName in self._engineNames:
+                    throughput = self._Throughput(engines[engineName], ruleSet, quantities)
+                    results[engineName].setdefault(itemCount, []).append((basketSize, throughput))
+        return results
+
+    def Plot(self, results, path):
+        """
+        Plots throughput against basket size for each engine and item
+        count. Requires matplotlib.
+        """
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        figure, axes = plt.subplots()
+        for engineName, byItemCount in results.items():
+            for itemCount, points in byItemCount.items():
+                axes.plot([size for size, _ in points], [throughput for _, throughput in points], marker='o', label='{} ({} items)'.format(engineName, itemCount))
+        axes.set_xscale('log')
+        axes.set_yscale('log')
+        axes.set_xlabel('basket size (units)')
+        axes.set_ylabel('throughput (units/s)')
+        axes.legend(fontsize='small')
+        figure.savefig(path)
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'fuzz'
+    if command == 'fuzz':
+        iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        seed = sys.argv[3] if len(sys.argv) > 3 else str(time.time_ns())
+        maxUnits = int(sys.argv[4]) if len(sys.argv) > 4 else 1000000
+        mismatches = DifferentialFuzzer(seed, maxUnits).Run(iterations)
+        for mismatch in mismatches:
+            print(mismatch)
+        print('{} cases, {} mismatches (seed {})'.format(iterations, len(mismatches), seed))
+        sys.exit(1 if mismatches else 0)
+    elif command == 'bench':
+        benchmark = ScalingBenchmark([10, 100, 1000, 10000, 100000, 1000000], [5, 50, 500], ['reference', 'compiled', 'packed'])
+        results = benchmark.Run()
+        for engineName, byItemCount in results.items():
+            for itemCount, points in byItemCount.items():
+                for basketSize, throughput in points:
+                    print('{:<9} {:>4} items {:>8} units {:>14,.0f} units/s'.format(engineName, itemCount, basketSize, throughput))
+        if len(sys.argv) > 2:
+            try:
+                benchmark.Plot(results, sys.argv[2])
+                print('Plot written to {}'.format(sys.argv[2]))
+            except ImportError:
+                print('Install matplotlib to plot the results.')
+    else:
+        print(__doc__)
@@ -0,0 +1,202 @@
+import os
+from collections import OrderedDict
+from importlib import import_module
+from importlib.util import find_spec
+from threading import Lock
+
+from unidays import UnidaysDiscountChallenge
+from rules_compiler import CompileRules
+
+class RuleSetError(Exception):
+    """
+    Raised when a rule set's source exists but cannot be loaded.
+    """
+
+class RuleSet:
+    def __init__(self, rulesetId, pricingRules, deliveryRules, version=None):
+        # ==== PUBLIC PROPERTIES ====
+        self.rulesetId = rulesetId
+        self.pricingRules = pricingRules
+        self.deliveryRules = deliveryRules
+        # fingerprint of the rules so that derived artefacts can be cached per version
+        self.version = version or self._Fingerprint()
+        # why the rules could not be compiled, so that compiling is not retried on every request
+        self.compileError = None
+
+    # ==== PROTECTED METHODS ====
+    def _Fingerprint(self):
+        """
+        Returns a hash of the rules.
+        """
+        # imported here as json and hashlib dominate startup when rule sets come from a snapshot
+        import json
+        from hashlib import sha1
+        return sha1(json.dumps([self.pricingRules, self.deliveryRules], sort_keys=True, default=str).encode()).hexdigest()
+
+    # ==== PUBLIC METHODS ====
+    def Checkout(self):
+        """
+        Returns a new checkout priced against this rule set.
+        """
+        return UnidaysDiscountChallenge(self.pricingRules, self.deliveryRules)
+
+    def Engine(self, engineName):
+        """
+        Returns the engine to pass to RunUnidays for the engine name,
+        where None selects the reference classes. Rules that cannot be
+        compiled are priced by the reference classes, which fail only the
+        baskets the broken rules apply to.
+        """
+        if engineName == 'compiled' and self.compileError is None:
+            try:
+                return CompileRules(self.pricingRules, self.deliveryRules, self.version)
+            except Exception as error:
+                self.compileError = error
+
+class RulesRegistry:
+    def __init__(self, ruleSetSources, maxSize, rulesDirectory=None):
+        # ==== PROTECTED PROPERTIES ====
+        # where each known rule set can be loaded from, keyed by ruleset id
+        self._ruleSetSources = ruleSetSources
+        # maximum number of rule sets held in memory at once
+        self._maxSize = maxSize
+        # optional directory of <rulesetId>.json files for rule sets not listed in the sources
+        self._rulesDirectory = rulesDirectory
+        # loaded rule sets ordered from least to most recently used
+        self._ruleSets = OrderedDict()
+        self._lock = Lock()
+
+    # ==== PROTECTED METHODS ====
+    def _PlainId(self, rulesetId):
+        """
+        Checks that a ruleset id is plain enough to name a file in the
+        rules directory, so that it cannot point outside the directory.
+        """
+        # imported here as re dominates startup when rule sets come from a snapshot
+        import re
+        return re.fullmatch(r'[A-Za-z0-9_-]+', rulesetId) is not None
+
+    def _LoadFromModule(self, rulesetId, source):
+        """
+        Loads a rule set from the config module named in its source.
+        """
+        module = import_module(source['module'])
+        return RuleSet(rulesetId, getattr(module, source['pricingRules']), getattr(module, source['deliveryRules']))
+
+    def _LoadFromDirectory(self, rulesetId):
+        """
+        Loads a rule set from its JSON file in the rules directory and
+        returns None if there is no such file.
+        """
+        # imported here as json dominates startup when rule sets come from a snapshot
+        import json
+        if not self._rulesDirectory or not self._PlainId(rulesetId):
+            return None
+        path = os.path.join(self._rulesDirectory, rulesetId + '.json')
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as rulesFile:
+                rules = json.load(rulesFile)
+            pricingRules, deliveryRules = rules['pricingRules'], rules['deliveryRules']
+        except (ValueError, KeyError, TypeError) as error:
+            raise RuleSetError('Rule set {!r} could not be loaded: {!r}'.format(rulesetId, error))
+        if not isinstance(pricingRules, dict) or not isinstance(deliveryRules, dict):
+            raise RuleSetError('Rule set {!r} could not be loaded: its rules are not objects'.format(rulesetId))
+        return RuleSet(rulesetId, pricingRules, deliveryRules)
+
+    def _SourcePath(self, rulesetId):
+        """
+        Returns the path of the file a rule set is loaded from, or None
+        if there is no such file.
+        """
+        if rulesetId in self._ruleSetSources:
+            spec = find_spec(self._ruleSetSources[rulesetId]['module'])
+            return spec.origin if spec and spec.has_location else None
+        if self._rulesDirectory:
+            return os.path.join(self._rulesDirectory, rulesetId + '.json')
+
+    def _Load(self, rulesetId):
+        """
+        Loads a rule set from its source and returns None for unknown ids.
+        """
+        if rulesetId in self._ruleSetSources:
+            return self._LoadFromModule(rulesetId, self._ruleSetSources[rulesetId])
+        return self._LoadFromDirectory(rulesetId)
+
+    def _Evict(self):
+        """
+        Drops the least recently used rule sets until the registry is
+        within its maximum size.
+        """
+        while len(self._ruleSets) > self._maxSize:
+            self._ruleSets.popitem(last=False)
+
+    # ==== PUBLIC METHODS ====
+    def Get(self, rulesetId):
+        """
+        Returns the rule set for the ruleset id, loading and compiling it
+        on first use, or None if the ruleset id is unknown. Raises RuleSetError if its
+        source cannot be loaded.
+        """
+        with self._lock:
+            if rulesetId in self._ruleSets:
+                self._ruleSets.move_to_end(rulesetId)
+                return self._ruleSets[rulesetId]
+        # load outside the lock so a slow load does not block other tenants
+        ruleSet = self._Load(rulesetId)
+        if ruleSet is None:
+            return None
+        # compile and check the engine as the rule set loads rather than on its first compiled request
+        ruleSet.Engine('compiled')
+        with self._lock:
+            # keep the first copy if another request loaded it concurrently
+            ruleSet = self._ruleSets.setdefault(rulesetId, ruleSet)
+            self._ruleSets.move_to_end(rulesetId)
+            self._Evict()
+        return ruleSet
+
+    def Add(self, ruleSet):
+        """
+        Adds an already loaded rule set, e.g. from a snapshot, replacing
+        any rule set with the same id.
+        """
+        with self._lock:
+            self._ruleSets[ruleSet.rulesetId] = ruleSet
+            self._ruleSets.move_to_end(ruleSet.rulesetId)
+            self._Evict()
+
+    def SourceFingerprint(self, rulesetId):
+        """
+        Returns a hash of the contents of the file a rule set is loaded
+        from, or None if it cannot be read, so that copies taken from it
+        can be checked for staleness without loading it.
+        """
+        # imported here as hashlib dominates startup when rule sets come from a snapshot
+        from hashlib import sha1
+        path = self._SourcePath(rulesetId)
+        try:
+            with open(path, 'rb') as sourceFile:
+                return sha1(sourceFile.read()).hexdigest()
+        except (OSError, TypeError):
+            return None
+
+    def Known(self):
+        """
+        Returns the ids of all rule sets that can be loaded.
+        """
+        rulesetIds = list(self._ruleSetSources)
+        if self._rulesDirectory and os.path.isdir(self._rulesDirectory):
+            for fileName in sorted(os.listdir(self._rulesDirectory)):
+                rulesetId, extension = os.path.splitext(fileName)
+                if extension == '.json' and rulesetId not in rulesetIds and self._PlainId(rulesetId):
+                    rulesetIds.append(rulesetId)
+        return rulesetIds
+
+    def Loaded(self):
+        """
+        Returns the ids of the rule sets currently held in memory, from
+        least to most recently used.
+        """
+        with self._lock:
+            return list(self._ruleSets)
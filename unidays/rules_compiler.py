@@ -0,0 +1,273 @@
+import math
+from collections import OrderedDict
+from itertools import chain, repeat
+from threading import Lock
+
+from unidays import UnidaysDiscountChallenge, ErrorLogger, ItemValidator, Delivery
+from unidays_run import RunUnidays
+
+# number of compiled engines kept in memory, shared by rule sets with the same version
+engineCacheSize = 256
+# largest quantity the compiler replays through the reference classes when checking an item
+verifyLimit = 10000
+
+class RulesMismatchError(Exception):
+    """
+    Raised when a compiled pricing function disagrees with the reference
+    classes.
+    """
+
+def Comparable(value):
+    """
+    Returns a response in a form that only compares equal to another
+    response with the same values of the same types, so that 1, 1.0 and
+    True differ, and where nan compares equal to nan.
+    """
+    if isinstance(value, dict):
+        return {key: Comparable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [Comparable(item) for item in value]
+    if isinstance(value, float) and math.isnan(value):
+        return (float, 'nan')
+    return (type(value), value)
+
+class CompiledEngine:
+    def __init__(self, version, source, constants, price):
+        # ==== PUBLIC PROPERTIES ====
+        self.version = version
+        # generated source and the constants it refers to, kept for inspection and for snapshots
+        self.source = source
+        self.constants = constants
+
+        # ==== PROTECTED PROPERTIES ====
+        self._price = price
+
+    # ==== PUBLIC METHODS ====
+    def Price(self, quantities):
+        """
+        Prices a mapping of items to quantities and returns the same
+        response as RunUnidays.
+        """
+        return self._price(quantities)
+
+class RulesCompiler:
+    def __init__(self, pricingRules, deliveryRules, version):
+        # ==== PROTECTED PROPERTIES ====
+        self._pricingRules = pricingRules
+        self._deliveryRules = deliveryRules
+        self._version = version
+        # constants the generated code refers to by name
+        self._namespace = {}
+        self._lines = []
+
+    # ==== PROTECTED METHODS ====
+    def _IsInteger(self, value):
+        """
+        Checks whether a rule value can be inlined as an exact integer.
+        """
+        return type(value) is int
+
+    def _Constant(self, value):
+        """
+        Adds a value to the generated code's namespace and returns its name.
+        """
+        name = '_constant{}'.format(len(self._namespace))
+        self._namespace[name] = value
+        return name
+
+    def _EmitItem(self, index, item):
+        """
+        Emits the pricing function for a valid item, with its prices and
+        bundle size inlined as constants, and returns its name, or None if
+        its rules cannot be inlined.
+        """
+        itemPricingRules = self._pricingRules[item]
+        name = '_price{}'.format(index)
+        unitPrice = itemPricingRules['price']
+        status = itemPricingRules['status']
+        if status == 'notDiscountable' and self._IsInteger(unitPrice):
+            self._lines.append('def {}(quantity):'.format(name))
+            self._lines.append('    return {0} * quantity, 0, {0}'.format(unitPrice))
+        elif (status == 'Discountable' and self._IsInteger(unitPrice)
+              and self._IsInteger(itemPricingRules['discountFrequency'])
+              and self._IsInteger(itemPricingRules['discountedPrice'])):
+            discountFrequency = itemPricingRules['discountFrequency']
+            discountedPrice = itemPricingRules['discountedPrice']
+            self._lines.append('def {}(quantity):'.format(name))
+            # a bundle size below 1 is never reached so no discount applies
+            if discountFrequency < 1:
+                self._lines.append('    return {0} * quantity, 0, {0}'.format(unitPrice))
+            else:
+                self._lines.append('    deals, rest = divmod(quantity, {})'.format(discountFrequency))
+                self._lines.append('    return deals * {} + rest * {}, deals * {}, {}'.format(
+                    discountedPrice, unitPrice, unitPrice * discountFrequency - discountedPrice, unitPrice))
+        else:
+            return None
+        return name
+
+    def _Number(self, value):
+        """
+        Returns the source for a numeric rule value, inlining finite
+        numbers and naming the rest as constants since inf and nan have no
+        literal form.
+        """
+        if math.isfinite(value):
+            return repr(value)
+        return self._Constant(value)
+
+    def _EmitDelivery(self):
+        """
+        Emits the delivery charge as an inline comparison.
+        """
+        standard = self._deliveryRules['standard']
+        freeThreshold = self._deliveryRules['freeThreshold']
+        if type(standard) in (int, float) and type(freeThreshold) in (int, float):
+            freeThreshold = self._Number(freeThreshold)
+            self._lines.append('    if basket:')
+            # mirrors Delivery, which charges nothing when the total cannot be compared with the threshold
+            self._lines.append('        deliveryCharge = 0 if total >= {0} else {1} if total < {0} else None'.format(freeThreshold, self._Number(standard)))
+        else:
+            delivery = self._Constant(Delivery(self._deliveryRules))
+            self._lines.append('    if basket:')
+            self._lines.append('        deliveryCharge = {}.CalculateDeliveryPrice(total)'.format(delivery))
+
+    def _Generate(self):
+        """
+        Generates the source of the pricing function.
+        """
+        pricers = {}
+        itemErrors = {}
+        referenceItems = set()
+        for index, item in enumerate(self._pricingRules):
+            try:
+                validationErrors = ItemValidator(item, self._pricingRules).CheckValidity()
+            except Exception:
+                # rules too malformed to validate, e.g. not an object, only fail baskets holding the item
+                referenceItems.add(item)
+                continue
+            if validationErrors:
+                itemErrors[item] = validationErrors
+                continue
+            name = self._EmitItem(index, item)
+            if name:
+                pricers[item] = name
+            else:
+                referenceItems.add(item)
+        self._lines.append('_pricers = {{{}}}'.format(', '.join('{!r}: {}'.format(item, name) for item, name in pricers.items())))
+        self._namespace['_itemErrors'] = itemErrors
+        self._namespace['_noPricingRules'] = ErrorLogger(['noPricingRules']).HandleError()
+        self._lines.append('def price(quantities):')
+        if referenceItems:
+            # unusual rules (non-integer or non-finite prices, unknown statuses, malformed items) change how the
+            # reference classes total the whole basket unit by unit, so such baskets are priced there
+            self._lines += [
+                '    if not {}.isdisjoint(quantities):'.format(self._Constant(frozenset(referenceItems))),
+                '        return {}(quantities)'.format(self._Constant(self._ReferencePrice)),
+            ]
+        self._lines += [
+            '    total = 0',
+            '    savings = 0',
+            '    deliveryCharge = 0',
+            '    basket = {}',
+            '    errors = {}',
+            '    for item, quantity in quantities.items():',
+            '        if quantity <= 0:',
+            '            continue',
+            '        pricer = _pricers.get(item)',
+            '        if pricer is None:',
+            '            errors[item] = dict(_itemErrors.get(item, _noPricingRules))',
+            '            continue',
+            '        finalCost, itemSavings, unitPrice = pricer(quantity)',
+            '        total += finalCost',
+            '        savings += itemSavings',
+            "        basket[item] = {'quantity': quantity, 'unitPrice': unitPrice, 'itemSavings': itemSavings, 'finalCost': finalCost}",
+        ]
+        self._EmitDelivery()
+        self._lines += [
+            "    res = {'Total': total, 'Savings': savings, 'DeliveryCharge': deliveryCharge, 'Basket': basket}",
+            '    if errors:',
+            "        res['Errors'] = errors",
+            '    return res',
+        ]
+        return '\n'.join(self._lines) + '\n'
+
+    def _ReferencePrice(self, quantities):
+        """
+        Prices a mapping of items to quantities through the reference classes.
+        """
+        checkout = UnidaysDiscountChallenge(self._pricingRules, self._deliveryRules)
+        return RunUnidays(checkout, chain.from_iterable(repeat(item, quantity) for item, quantity in quantities.items())).All()
+
+    def _Outcome(self, price, quantities):
+        """
+        Returns the response of a pricing function, or the type of the
+        exception it raised.
+        """
+        try:
+            return Comparable(price(quantities))
+        except Exception as error:
+            return type(error)
+
+    def _Verify(self, price):
+        """
+        Checks the compiled function against the reference classes for
+        each item around its bundle sizes.
+        """
+        for item, itemPricingRules in self._pricingRules.items():
+            discountFrequency = itemPricingRules.get('discountFrequency') if isinstance(itemPricingRules, dict) else None
+            quantities = {1, 2, 3}
+            if self._IsInteger(discountFrequency):
+                quantities |= {discountFrequency - 1, discountFrequency, discountFrequency + 1, 2 * discountFrequency + 1}
+            for quantity in sorted(quantity for quantity in quantities if 0 < quantity <= verifyLimit):
+                basket = {item: quantity}
+                if self._Outcome(price, basket) != self._Outcome(self._ReferencePrice, basket):
+                    raise RulesMismatchError('Compiled pricing for item {!r} x{} disagrees with the reference classes.'.format(item, quantity))
+
+    # ==== PUBLIC METHODS ====
+    def Compile(self, verify=True):
+        """
+        Compiles the rules into a specialized pricing function, checks it
+        against the reference classes and returns it as an engine.
+        """
+        source = self._Generate()
+        constants = dict(self._namespace)
+        exec(compile(source, '<rules {}>'.format(self._version), 'exec'), self._namespace)
+        price = self._namespace['price']
+        if verify:
+            self._Verify(price)
+        return CompiledEngine(self._version, source, constants, price)
+
+_engineCache = OrderedDict()
+_engineCacheLock = Lock()
+
+def CacheEngine(engine):
+    """
+    Adds a compiled engine to the cache, keeping any engine already
+    cached for its version, and returns the cached engine.
+    """
+    with _engineCacheLock:
+        engine = _engineCache.setdefault(engine.version, engine)
+        _engineCache.move_to_end(engine.version)
+        while len(_engineCache) > engineCacheSize:
+            _engineCache.popitem(last=False)
+    return engine
+
+def LoadEngine(version, source, constants, code=None):
+    """
+    Rebuilds and caches a previously compiled and checked engine from its
+    source and constants, using its code object when one is given.
+    """
+    namespace = dict(constants)
+    exec(code or compile(source, '<rules {}>'.format(version), 'exec'), namespace)
+    return CacheEngine(CompiledEngine(version, source, constants, namespace['price']))
+
+def CompileRules(pricingRules, deliveryRules, version):
+    """
+    Returns the compiled engine for a version of the rules, compiling it
+    on first use.
+    """
+    with _engineCacheLock:
+        if version in _engineCache:
+            _engineCache.move_to_end(version)
+            return _engineCache[version]
+    return CacheEngine(RulesCompiler(pricingRules, deliveryRules, version).Compile())
@@ -0,0 +1,187 @@
+"""
+Builds and loads precompiled pricing snapshots so that workers and the
+checkout CLI start without loading, validating and compiling rule sets.
+
+Usage:
+    python3 snapshot.py build [path]   write the snapshot
+    python3 snapshot.py measure        report cold-start times with and without it
+"""
+import marshal
+import os
+import sys
+import time
+
+from registry import RuleSet, RuleSetError
+from rules_compiler import LoadEngine
+
+# bumped whenever the layout of the snapshot changes
+snapshotFormat = 3
+# marshal data and code objects are only valid for the interpreter version that wrote them
+_magic = 'UDSNAP{}:{}\n'.format(snapshotFormat, sys.implementation.cache_tag).encode()
+
+class SnapshotBuilder:
+    def __init__(self, rulesRegistry):
+        # ==== PROTECTED PROPERTIES ====
+        self._rulesRegistry = rulesRegistry
+
+        # ==== PUBLIC PROPERTIES ====
+        # reasons the rule sets left out of the last build could not be loaded, keyed by ruleset id
+        self.skipped = {}
+
+    # ==== PROTECTED METHODS ====
+    def _EngineRecord(self, ruleSet):
+        """
+        Compiles and checks a rule set's engine and returns what is needed
+        to rebuild it, or None if it cannot be stored.
+        """
+        try:
+            engine = ruleSet.Engine('compiled')
+            # engines that fall back to the reference classes hold live objects and are compiled when the snapshot loads instead
+            marshal.dumps(engine.constants)
+        except Exception:
+            return None
+        code = compile(engine.source, '<rules {}>'.format(engine.version), 'exec')
+        return {'source': engine.source, 'constants': engine.constants, 'code': code}
+
+    # ==== PUBLIC METHODS ====
+    def Build(self, path):
+        """
+        Writes a snapshot of every known rule set and its compiled engine
+        and returns the ids of the rule sets written. Rule sets that cannot
+        be loaded are left out and listed in skipped, and load from source
+        on first use as before.
+        """
+        ruleSets = []
+        self.skipped = {}
+        for rulesetId in self._rulesRegistry.Known():
+            try:
+                ruleSet = self._rulesRegistry.Get(rulesetId)
+            except RuleSetError as error:
+                self.skipped[rulesetId] = str(error)
+                continue
+            if ruleSet is None:
+                self.skipped[rulesetId] = 'Rule set {!r} no longer exists'.format(rulesetId)
+                continue
+            ruleSets.append({
+                'rulesetId': ruleSet.rulesetId,
+                'pricingRules': ruleSet.pricingRules,
+                'deliveryRules': ruleSet.deliveryRules,
+                'version': ruleSet.version,
+                'source': self._rulesRegistry.SourceFingerprint(rulesetId),
+                'engine': self._EngineRecord(ruleSet)
+            })
+        payload = marshal.dumps(ruleSets)
+        # write to a temporary file first so that workers never read a partial snapshot
+        with open(path + '.tmp', 'wb') as snapshotFile:
+            snapshotFile.write(_magic + payload)
+        os.replace(path + '.tmp', path)
+        return [ruleSet['rulesetId'] for ruleSet in ruleSets]
+
+def LoadSnapshot(path, rulesRegistry):
+    """
+    Loads a snapshot in one read, adding its rule sets to the registry
+    and its engines to the engine cache. Rule sets whose source file has
+    changed since the build are skipped and load from source on first
+    use. Returns the ids of the rule sets loaded, or None if there is no
+    usable snapshot.
+    """
+    try:
+        with open(path, 'rb') as snapshotFile:
+            data = snapshotFile.read()
+    except OSError:
+        return None
+    # snapshots from another format or interpreter version are ignored
+    if not data.startswith(_magic):
+        return None
+    ruleSets = marshal.loads(data[len(_magic):])
+    loaded = []
+    for record in ruleSets:
+        # a missing fingerprint means the source could not be read when the snapshot was built
+        if record['source'] is None or record['source'] != rulesRegistry.SourceFingerprint(record['rulesetId']):
+            continue
+        ruleSet = RuleSet(record['rulesetId'], record['pricingRules'], record['deliveryRules'], record['version'])
+        rulesRegistry.Add(ruleSet)
+        engine = record['engine']
+        if engine:
+            LoadEngine(record['version'], engine['source'], engine['constants'], engine['code'])
+        else:
+            # engines that could not be stored are compiled now rather than on their first request
+            ruleSet.Engine('compiled')
+        loaded.append(record['rulesetId'])
+    return loaded
+
+# script run in a fresh interpreter to time a cold start up to the first priced basket
+_coldStartScript = '''
+import time
+started = time.perf_counter()
+from config_api import ruleSetSources, registrySettings, snapshotSettings
+from registry import RulesRegistry
+rulesRegistry = RulesRegistry(ruleSetSources, registrySettings['maxSize'], registrySettings['rulesDirectory'])
+if {useSnapshot}:
+    from snapshot import LoadSnapshot
+    LoadSnapshot(snapshotSettings['path'], rulesRegistry)
+for rulesetId in rulesRegistry.Known():
+    rulesRegistry.Get(rulesetId).Engine('compiled').Price({{'A': 1}})
+print(time.perf_counter() - started)
+'''
+
+class ColdStartBenchmark:
+    def __init__(self, repeats):
+        # ==== PROTECTED PROPERTIES ====
+        self._repeats = repeats
+
+    # ==== PROTECTED METHODS ====
+    def _Run(self, script):
+        """
+        Runs a script in a fresh interpreter and returns the time it
+        reports and the wall time of the whole process, in milliseconds.
+        """
+        # only needed when measuring, so kept out of the import path of workers
+        import subprocess
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+        return float(output.split()[-1]) * 1000, (time.perf_counter() - started) * 1000
+
+    def _Median(self, script):
+        """
+        Returns the median timings of a script over the repeats.
+        """
+        runs = sorted(self._Run(script) for _ in range(self._repeats))
+        return runs[len(runs) // 2]
+
+    # ==== PUBLIC METHODS ====
+    def Measure(self):
+        """
+        Returns the median cold-start timings with and without the
+        snapshot, and for importing the API if Flask is installed.
+        """
+        timings = {
+            'rules without snapshot': self._Median(_coldStartScript.format(useSnapshot=False)),
+            'rules with snapshot': self._Median(_coldStartScript.format(useSnapshot=True))
+        }
+        apiScript = 'import time\nstarted = time.perf_counter()\nimport checkout_api\nprint(time.perf_counter() - started)\n'
+        try:
+            timings['api import'] = self._Median(apiScript)
+        except Exception:
+            # Flask is not installed
+            pass
+        return timings
+
+if __name__ == '__main__':
+    from config_api import ruleSetSources, registrySettings, snapshotSettings
+    from registry import RulesRegistry
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        path = sys.argv[2] if len(sys.argv) > 2 else snapshotSettings['path']
+        rulesRegistry = RulesRegistry(ruleSetSources, registrySettings['maxSize'], registrySettings['rulesDirectory'])
+        started = time.perf_counter()
+        builder = SnapshotBuilder(rulesRegistry)
+        rulesetIds = builder.Build(path)
+        print('Wrote {} rule sets to {} in {:.1f}ms'.format(len(rulesetIds), path, (time.perf_counter() - started) * 1000))
+        for rulesetId, reason in builder.skipped.items():
+            print('Skipped {}: {}'.format(rulesetId, reason))
+    elif command == 'measure':
+        for name, (startup, process) in ColdStartBenchmark(15).Measure().items():
+            print('{:<24} startup {:>7.1f}ms  process {:>7.1f}ms'.format(name, startup, process))
+    else:
+        print(__doc__)
@@ -1,8 +1,10 @@
 class RunUnidays:
-    def __init__(self, checkout, itemsToAdd):
+    def __init__(self, checkout, itemsToAdd, engine=None):
         # ==== PROTECTED PROPERTIES ====
         self._checkout = checkout
         self._itemsToAdd = itemsToAdd
+        # optional compiled engine that prices the items instead of the checkout
+        self._engine = engine
         self._detailedBasket = {}
         self._errors = {}
     
@@ -46,11 +48,22 @@ class RunUnidays:
             res['Errors'] = self._errors
         return res
 
+    def _EngineResponse(self):
+        """
+        Tallies the items and prices them with the compiled engine.
+        """
+        quantities = {}
+        for item in self._itemsToAdd:
+            quantities[item] = quantities.get(item, 0) + 1
+        return self._engine.Price(quantities)
+
     # ==== PUBLIC METHODS ====
     def All(self):
         """
         Runs all required functions to return the checkout.
         """
+        if self._engine:
+            return self._EngineResponse()
         self._AddItems()
         self._PopulateBasket()
         return self._Response()
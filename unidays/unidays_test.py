@@ -1,9 +1,26 @@
+import io
+import json
+import os
+import tempfile
+import time
 import unittest
+from importlib.util import find_spec
 
 from unidays import UnidaysDiscountChallenge
 from utils import errors
 from config import pricingRules, deliveryRules
 from config_alt import pricingRulesAlt, deliveryRulesAlt
+from config_api import ruleSetSources
+from registry import RulesRegistry, RuleSetError
+from basket_index import BasketIndex
+from unidays_run import RunUnidays
+from bulk import BulkOrderReader
+from rules_compiler import RulesCompiler, RulesMismatchError, CompileRules, Comparable
+from registry import RuleSet
+from admission import AdmissionController
+from snapshot import SnapshotBuilder, LoadSnapshot
+import engine_fuzz
+from wire import WireFormatError, EncodeBasket, DecodeBasket, EncodeTotals, DecodeTotals
 
 class Test(unittest.TestCase):
     def setUp(self):
@@ -302,5 +319,523 @@ class Test(unittest.TestCase):
             priceCalculator.AddToBasket(item)
         self.assertEqual(priceCalculator.price['DeliveryCharge'], 0)
 
+class RegistryTest(unittest.TestCase):
+    def test_lazy_loading(self):
+        """
+        Tests that rule sets are only loaded when first requested and
+        that unknown ruleset ids are rejected.
+        """
+        registry = RulesRegistry(ruleSetSources, 2)
+        self.assertEqual(registry.Loaded(), [])
+        ruleSet = registry.Get('alt')
+        self.assertEqual(ruleSet.pricingRules, pricingRulesAlt)
+        self.assertEqual(ruleSet.deliveryRules, deliveryRulesAlt)
+        self.assertIs(registry.Get('alt'), ruleSet)
+        self.assertEqual(registry.Loaded(), ['alt'])
+        self.assertIsNone(registry.Get('missing'))
+        self.assertIsNone(registry.Get('../config'))
+
+    def test_compiled_on_load(self):
+        """
+        Tests that a rule set's engine is compiled when the rule set
+        loads, not on its first compiled request.
+        """
+        import rules_compiler
+        with tempfile.TemporaryDirectory() as rulesDirectory:
+            with open(os.path.join(rulesDirectory, 'fresh.json'), 'w') as rulesFile:
+                json.dump({'pricingRules': pricingRules, 'deliveryRules': {'standard': 7, 'freeThreshold': 4321}}, rulesFile)
+            ruleSet = RulesRegistry({}, 2, rulesDirectory).Get('fresh')
+        self.assertIn(ruleSet.version, rules_compiler._engineCache)
+
+    def test_lru_eviction(self):
+        """
+        Tests that the least recently used rule set is evicted once the
+        registry is full.
+        """
+        with tempfile.TemporaryDirectory() as rulesDirectory:
+            with open(os.path.join(rulesDirectory, 'outlet.json'), 'w') as rulesFile:
+                json.dump({'pricingRules': pricingRules, 'deliveryRules': deliveryRules}, rulesFile)
+            registry = RulesRegistry(ruleSetSources, 2, rulesDirectory)
+            registry.Get('default')
+            registry.Get('alt')
+            registry.Get('default')
+            registry.Get('outlet')
+            self.assertEqual(registry.Loaded(), ['default', 'outlet'])
+            self.assertEqual(registry.Get('outlet').version, registry.Get('default').version)
+
+    def test_malformed_rules_file(self):
+        """
+        Tests that a rules file that cannot be loaded raises RuleSetError
+        and is retried once fixed.
+        """
+        with tempfile.TemporaryDirectory() as rulesDirectory:
+            path = os.path.join(rulesDirectory, 'outlet.json')
+            registry = RulesRegistry({}, 2, rulesDirectory)
+            for contents in ('{"pricingRules": ', '{"pricingRules": {}}', '[]', '{"pricingRules": [], "deliveryRules": {}}'):
+                with open(path, 'w') as rulesFile:
+                    rulesFile.write(contents)
+                with self.assertRaises(RuleSetError):
+                    registry.Get('outlet')
+            with open(path, 'w') as rulesFile:
+                json.dump({'pricingRules': pricingRules, 'deliveryRules': deliveryRules}, rulesFile)
+            self.assertEqual(registry.Get('outlet').pricingRules, pricingRules)
+
+@unittest.skipUnless(find_spec('flask'), 'the API requires Flask')
+class RulesetApiTest(unittest.TestCase):
+    def test_malformed_rules_file(self):
+        """
+        Tests that a malformed rules file gets a defined error response.
+        """
+        import checkout_api
+        with tempfile.TemporaryDirectory() as rulesDirectory:
+            with open(os.path.join(rulesDirectory, 'outlet.json'), 'w') as rulesFile:
+                rulesFile.write('{"pricingRules": ')
+            rulesRegistry = checkout_api.rulesRegistry
+            checkout_api.rulesRegistry = RulesRegistry({}, 2, rulesDirectory)
+            try:
+                response = checkout_api.app.test_client().post('/price', json={'items': 'A', 'ruleset': 'outlet'})
+            finally:
+                checkout_api.rulesRegistry = rulesRegistry
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['Message'], checkout_api.errors['invalidRuleset'])
+
+class BasketIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._pricingRules = dict(pricingRules, **pricingRulesAlt)
+        self._baskets = {
+            'b1': list('BBBBCCC'),
+            'b2': list('AAZ'),
+            'b3': list('ABBCCCDDEE'),
+            'b4': list('II'),
+            'b5': list('DDDDDDD'),
+        }
+
+    def _FullPrice(self, pricingRules, items):
+        checkout = UnidaysDiscountChallenge(pricingRules, deliveryRules)
+        return RunUnidays(checkout, items).All()
+
+    def test_incremental_repricing(self):
+        """
+        Tests that re-pricing after rule changes only touches baskets
+        containing the item and matches a full re-price.
+        """
+        index = BasketIndex(self._pricingRules, deliveryRules)
+        for basketId, items in self._baskets.items():
+            index.StoreBasket(basketId, items)
+        ruleChanges = [
+            ('A', {'price': 30, 'status': 'notDiscountable'}),
+            ('D', {'price': 9, 'status': 'Discountable', 'discountFrequency': 3, 'discountedPrice': 12}),
+            ('Z', {'price': 2, 'status': 'notDiscountable'}),
+            ('I', {'price': 7, 'status': 'notDiscountable'}),
+            ('E', {'price': 0.1, 'status': 'Discountable', 'discountFrequency': 3, 'discountedPrice': 0.25}),
+            ('B', {'price': 12}),
+            ('C', None),
+        ]
+        for item, itemPricingRules in ruleChanges:
+            if itemPricingRules is None:
+                del self._pricingRules[item]
+            else:
+                self._pricingRules[item] = itemPricingRules
+            affected = index.UpdateRule(item, itemPricingRules)
+            self.assertEqual(affected, {basketId for basketId, items in self._baskets.items() if item in items})
+            for basketId, items in self._baskets.items():
+                self.assertEqual(index.Price(basketId), self._FullPrice(self._pricingRules, items))
+
+class BulkOrderReaderTest(unittest.TestCase):
+    def test_streamed_tally(self):
+        """
+        Tests that a streamed body prices the same as the equivalent
+        list of items.
+        """
+        body = b'bbbbccc\nABBCCCDDEE z\r\n' * 50
+        reader = BulkOrderReader(io.BytesIO(body), len(body), 7)
+        self.assertTrue(reader.Read())
+        self.assertEqual(reader.quantities, {'B': 300, 'C': 300, 'A': 50, 'D': 100, 'E': 100, 'Z': 50})
+        streamed = RunUnidays(UnidaysDiscountChallenge(pricingRules, deliveryRules), reader.Items()).All()
+        items = list(body.decode().upper().replace('\n', '').replace('\r', '').replace(' ', ''))
+        self.assertEqual(streamed, RunUnidays(UnidaysDiscountChallenge(pricingRules, deliveryRules), items).All())
+
+    def test_size_cap(self):
+        """
+        Tests that reading stops once the body exceeds the size cap.
+        """
+        reader = BulkOrderReader(io.BytesIO(b'A' * 100), 64, 16)
+        self.assertFalse(reader.Read())
+        self.assertEqual(reader.bytesRead, 80)
+
+    def test_multibyte_items(self):
+        """
+        Tests that UTF-8 characters split across chunks are tallied as
+        single capitalized items, as on the JSON path.
+        """
+        body = 'aé\né'.encode('utf-8')
+        reader = BulkOrderReader(io.BytesIO(body), len(body), 1)
+        self.assertTrue(reader.Read())
+        self.assertEqual(reader.quantities, {'A': 1, 'É': 2})
+
+class WireFormatTest(unittest.TestCase):
+    def test_round_trip(self):
+        """
+        Tests that packed baskets and totals decode to the same basket
+        and response as the JSON path.
+        """
+        quantities = {'A': 1, 'B': 300, 'C': 3, 'Z': 2, 'I': 1, 'J': 5}
+        basket = DecodeBasket(EncodeBasket(quantities, 'alt'))
+        self.assertEqual(basket.rulesetId, 'alt')
+        self.assertEqual(basket.quantities, quantities)
+        checkout = UnidaysDiscountChallenge(dict(pricingRules, **pricingRulesAlt), deliveryRules)
+        res = RunUnidays(checkout, basket.Items()).All()
+        self.assertEqual(DecodeTotals(EncodeTotals(res)), res)
+        self.assertIsNone(DecodeBasket(EncodeBasket({})).rulesetId)
+        self.assertEqual(DecodeBasket(EncodeBasket({'a': 3, 'A': 1, 'b': 2})).quantities, {'A': 4, 'B': 2})
+
+    def test_float_amounts(self):
+        """
+        Tests that non-integer prices survive the packed format.
+        """
+        floatRules = {'K': {'price': 2.5, 'status': 'notDiscountable'}}
+        res = RunUnidays(UnidaysDiscountChallenge(floatRules, {'standard': 0.5, 'freeThreshold': float('inf')}), list('KK')).All()
+        self.assertEqual(res['Total'], 5.0)
+        self.assertEqual(DecodeTotals(EncodeTotals(res)), res)
+        self.assertIsNone(DecodeTotals(EncodeTotals(dict(res, DeliveryCharge=None)))['DeliveryCharge'])
+        self.assertIs(DecodeTotals(EncodeTotals(dict(res, Savings=True)))['Savings'], True)
+        with self.assertRaises(WireFormatError):
+            EncodeTotals(dict(res, Total=2 ** 64))
+        with self.assertRaises(WireFormatError):
+            EncodeTotals(dict(res, Total='5'))
+
+    def test_malformed_body(self):
+        """
+        Tests that malformed packed bodies are rejected.
+        """
+        payload = EncodeBasket({'A': 200})
+        for malformed in (b'', b'{"items": "a"}', payload[:-1], payload + b'\x00', payload[:4] + b'\xff' * 12):
+            with self.assertRaises(WireFormatError):
+                DecodeBasket(malformed)
+
+class RulesCompilerTest(unittest.TestCase):
+    def setUp(self):
+        self._pricingRules = dict(pricingRules, **pricingRulesAlt)
+        self._pricingRules.update({
+            'K': {'price': 2.5, 'status': 'notDiscountable'},
+            'L': {'price': 6, 'status': 'Discountable', 'discountFrequency': 0, 'discountedPrice': 1},
+            'M': {'price': 3, 'status': 'Discountable', 'discountFrequency': 1, 'discountedPrice': 2},
+        })
+
+    def test_matches_reference(self):
+        """
+        Tests that the compiled engine returns the same response as the
+        reference classes.
+        """
+        ruleSet = RuleSet('test', self._pricingRules, deliveryRulesAlt)
+        engine = ruleSet.Engine('compiled')
+        self.assertIsNone(ruleSet.Engine('reference'))
+        self.assertIs(CompileRules(self._pricingRules, deliveryRulesAlt, ruleSet.version), engine)
+        for items in ('', 'A', 'Z', 'IJ', 'BBBBCCC', 'EDCBAEDCBC', 'GGGGGGHHHH', 'H' * 61, 'KKKLLLMMM', 'ZZAIIJBK'):
+            reference = RunUnidays(ruleSet.Checkout(), list(items)).All()
+            self.assertEqual(RunUnidays(ruleSet.Checkout(), list(items), engine).All(), reference)
+
+    def test_inlined_constants(self):
+        """
+        Tests that integer rules are inlined into the generated source.
+        """
+        engine = RulesCompiler(pricingRules, deliveryRules, 'v1').Compile()
+        self.assertIn('divmod(quantity, 2)', engine.source)
+        self.assertIn('total >= 50', engine.source)
+        self.assertNotIn('_constant', engine.source)
+
+    def test_non_finite_delivery(self):
+        """
+        Tests that infinite and nan delivery rules compile and match the
+        reference classes.
+        """
+        for freeThreshold in (float('inf'), float('-inf'), float('nan'), 12.5):
+            rules = {'standard': 7, 'freeThreshold': freeThreshold}
+            engine = RulesCompiler(pricingRules, rules, repr(freeThreshold)).Compile()
+            for items in ('A', 'ABBCCCDDEE', 'EEEEEEEEEE'):
+                reference = RunUnidays(UnidaysDiscountChallenge(pricingRules, rules), list(items)).All()
+                self.assertEqual(RunUnidays(UnidaysDiscountChallenge(pricingRules, rules), list(items), engine).All(), reference)
+
+    def test_reference_baskets(self):
+        """
+        Tests that baskets containing items with float rules are priced
+        exactly as the reference classes total them unit by unit.
+        """
+        floatRules = dict(pricingRules, P={'price': 16.0, 'status': 'Discountable', 'discountFrequency': 2, 'discountedPrice': 4.95})
+        engine = RulesCompiler(floatRules, deliveryRules, 'float').Compile()
+        self.assertIn('divmod(quantity, 2)', engine.source)
+        for items in ('PP', 'PPPPP', 'AAPPPB', 'BBBBB'):
+            reference = RunUnidays(UnidaysDiscountChallenge(floatRules, deliveryRules), sorted(items)).All()
+            self.assertEqual(RunUnidays(UnidaysDiscountChallenge(floatRules, deliveryRules), sorted(items), engine).All(), reference)
+
+    def test_malformed_rules(self):
+        """
+        Tests that malformed item rules only fail baskets holding the item
+        and that rules that cannot be compiled fall back to the reference
+        classes.
+        """
+        brokenRules = dict(pricingRules, B=5)
+        engine = RulesCompiler(brokenRules, deliveryRules, 'brokenItem').Compile()
+        self.assertEqual(engine.Price({'A': 2}), RunUnidays(UnidaysDiscountChallenge(brokenRules, deliveryRules), list('AA')).All())
+        with self.assertRaises(TypeError):
+            engine.Price({'B': 1})
+        ruleSet = RuleSet('brokenDelivery', pricingRules, {'standard': 7})
+        self.assertIsNone(ruleSet.Engine('compiled'))
+        self.assertIsInstance(ruleSet.compileError, KeyError)
+
+    def test_mismatch_detected(self):
+        """
+        Tests that a compiled function that disagrees with the reference
+        classes is rejected.
+        """
+        compiler = RulesCompiler(pricingRules, deliveryRules, 'broken')
+        compiler._Generate = lambda: 'def price(quantities):\n    return {}\n'
+        with self.assertRaises(RulesMismatchError):
+            compiler.Compile()
+
+class AdmissionControllerTest(unittest.TestCase):
+    def setUp(self):
+        lanes = {
+            'standard': {'maxInFlight': 3, 'maxCost': 100, 'retryAfter': 1},
+            'oversized': {'maxInFlight': 1, 'maxCost': 1000, 'retryAfter': 10},
+        }
+        self._controller = AdmissionController(lanes, 200)
+
+    def test_standard_lane_shedding(self):
+        """
+        Tests that the standard lane sheds requests over its in-flight
+        and cost limits and admits them again once work is released.
+        """
+        tickets = [self._controller.Admit(40), self._controller.Admit(40)]
+        self.assertIsNone(self._controller.Admit(40))
+        tickets.append(self._controller.Admit(20))
+        self.assertIsNone(self._controller.Admit(0))
+        self.assertEqual(self._controller.RetryAfter(0), 1)
+        tickets[0].Release()
+        tickets[0].Release()
+        self.assertEqual(self._controller.inFlight['standard'], 2)
+        self.assertEqual(self._controller.inFlightCost['standard'], 60)
+        self.assertIsNotNone(self._controller.Admit(40))
+
+    def test_oversized_lane(self):
+        """
+        Tests that oversized baskets run in their own bounded lane
+        without using standard lane capacity.
+        """
+        oversized = self._controller.Admit(800)
+        self.assertEqual(oversized.laneName, 'oversized')
+        self.assertIsNone(self._controller.Admit(300))
+        self.assertEqual(self._controller.RetryAfter(300), 10)
+        self.assertIsNotNone(self._controller.Admit(100))
+        oversized.Release()
+        self.assertEqual(self._controller.Admit(300).laneName, 'oversized')
+
+    def test_cost_bound(self):
+        """
+        Tests that a request over its lane's budget is never admitted,
+        even when the lane is idle.
+        """
+        self.assertTrue(self._controller.Admissible(1000))
+        self.assertFalse(self._controller.Admissible(1001))
+        self.assertIsNone(self._controller.Admit(1001))
+        self.assertEqual(self._controller.inFlight['oversized'], 0)
+        self.assertIsNotNone(self._controller.Admit(1000))
+
+    def test_queue_wait_shedding(self):
+        """
+        Tests that requests that queued too long in front of the app are
+        shed without taking capacity.
+        """
+        controller = AdmissionController({'standard': {'maxInFlight': 3, 'maxCost': 100, 'retryAfter': 1}}, 200, 0.5)
+        self.assertIsNone(controller.Admit(10, 0.6))
+        self.assertEqual(controller.inFlight['standard'], 0)
+        self.assertIsNotNone(controller.Admit(10, 0.1))
+
+@unittest.skipUnless(find_spec('flask'), 'the API requires Flask')
+class AdmissionApiTest(unittest.TestCase):
+    def setUp(self):
+        import checkout_api
+        self._api = checkout_api
+        self._client = checkout_api.app.test_client()
+
+    def _Price(self, headers=None):
+        return self._client.post('/price', json={'items': 'ABBCCC'}, headers=headers or {})
+
+    def test_in_flight_shedding(self):
+        """
+        Tests that the admission hook sheds normal carts once the standard
+        lane is full, before the worker threads run out.
+        """
+        controller = self._api.admissionController
+        lane = self._api.admissionSettings['lanes']['standard']
+        self.assertLess(lane['maxInFlight'] + self._api.admissionSettings['lanes']['oversized']['maxInFlight'], 16)
+        tickets = [controller.Admit(10) for _ in range(lane['maxInFlight'])]
+        try:
+            response = self._Price()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], str(lane['retryAfter']))
+        finally:
+            for ticket in tickets:
+                ticket.Release()
+        self.assertEqual(self._Price().status_code, 200)
+        self.assertEqual(controller.inFlight['standard'], 0)
+
+    def test_queue_wait_shedding(self):
+        """
+        Tests that the admission hook sheds requests that waited too long
+        since the router's X-Request-Start.
+        """
+        now = time.time() * 1000
+        self.assertEqual(self._Price({'X-Request-Start': str(int(now - 5000))}).status_code, 503)
+        self.assertEqual(self._Price({'X-Request-Start': str(int(now))}).status_code, 200)
+
+@unittest.skipUnless(find_spec('flask'), 'the API requires Flask')
+class PackedApiTest(unittest.TestCase):
+    def setUp(self):
+        import checkout_api
+        self._api = checkout_api
+        self._client = checkout_api.app.test_client()
+
+    def _Post(self, body, **kwargs):
+        return self._client.post('/price/packed', data=body, content_type='application/x-unidays-basket', **kwargs)
+
+    def test_packed_price(self):
+        """
+        Tests that a packed basket is priced as on the JSON path.
+        """
+        response = self._Post(EncodeBasket({'a': 1, 'B': 2}))
+        self.assertEqual(response.status_code, 200)
+        reference = RunUnidays(UnidaysDiscountChallenge(pricingRules, deliveryRules), list('ABB')).All()
+        self.assertEqual(DecodeTotals(response.get_data()), reference)
+        self.assertEqual(self._Post(b'UDB').status_code, 400)
+
+    def test_body_size_checked_before_reading(self):
+        """
+        Tests that packed bodies without a declared size, or with one over
+        the cap, are rejected before they are read.
+        """
+        body = EncodeBasket({'A': 0, 'B': 0})
+        response = self._Post(None, input_stream=io.BytesIO(body), headers={'Transfer-Encoding': 'chunked'})
+        self.assertEqual(response.status_code, 411)
+        maxBodyBytes = self._api.bulkSettings['maxBodyBytes']
+        self._api.bulkSettings['maxBodyBytes'] = len(body) - 1
+        try:
+            self.assertEqual(self._Post(body).status_code, 413)
+        finally:
+            self._api.bulkSettings['maxBodyBytes'] = maxBodyBytes
+
+    def test_cost_counts_bytes(self):
+        """
+        Tests that a large body of zero-quantity items is costed by its
+        size rather than its units.
+        """
+        body = EncodeBasket({'S{}'.format(index): 0 for index in range(20000)})
+        self.assertGreater(len(body), self._api.admissionSettings['oversizedThreshold'])
+        with self._api.app.test_request_context('/price/packed', method='POST', data=body, content_type='application/x-unidays-basket'):
+            self._api.app.preprocess_request()
+            self.assertEqual(len(self._api.g.packedBasket.quantities), 20000)
+            self.assertEqual(self._api.g.admissionTicket.cost, len(body))
+            self.assertEqual(self._api.g.admissionTicket.laneName, 'oversized')
+            self._api.g.admissionTicket.Release()
+
+class SnapshotTest(unittest.TestCase):
+    def test_round_trip(self):
+        """
+        Tests that rule sets and compiled engines loaded from a snapshot
+        price the same as freshly loaded rule sets.
+        """
+        with tempfile.TemporaryDirectory() as snapshotDirectory:
+            path = os.path.join(snapshotDirectory, 'pricing.snapshot')
+            self.assertIsNone(LoadSnapshot(path, RulesRegistry(ruleSetSources, 4)))
+            self.assertEqual(SnapshotBuilder(RulesRegistry(ruleSetSources, 4)).Build(path), ['default', 'alt'])
+            registry = RulesRegistry(ruleSetSources, 4)
+            self.assertEqual(LoadSnapshot(path, registry), ['default', 'alt'])
+            self.assertEqual(registry.Loaded(), ['default', 'alt'])
+            fresh = RulesRegistry(ruleSetSources, 4)
+            for rulesetId in ('default', 'alt'):
+                ruleSet = registry.Get(rulesetId)
+                self.assertEqual(ruleSet.version, fresh.Get(rulesetId).version)
+                for items in ('ABBCCCDDEEZ', 'FGGGGGHIJ'):
+                    reference = RunUnidays(fresh.Get(rulesetId).Checkout(), list(items)).All()
+                    self.assertEqual(RunUnidays(ruleSet.Checkout(), list(items), ruleSet.Engine('compiled')).All(), reference)
+
+    def test_stale_sources_skipped(self):
+        """
+        Tests that rule sets whose source changed after the snapshot was
+        built are loaded from source rather than from the snapshot.
+        """
+        with tempfile.TemporaryDirectory() as rulesDirectory:
+            rulesPath = os.path.join(rulesDirectory, 'shop.json')
+            with open(rulesPath, 'w') as rulesFile:
+                json.dump({'pricingRules': pricingRules, 'deliveryRules': deliveryRules}, rulesFile)
+            path = os.path.join(rulesDirectory, 'pricing.snapshot')
+            self.assertEqual(SnapshotBuilder(RulesRegistry(ruleSetSources, 4, rulesDirectory)).Build(path), ['default', 'alt', 'shop'])
+            modified = os.stat(rulesPath).st_mtime_ns
+            size = os.stat(rulesPath).st_size
+            with open(rulesPath, 'w') as rulesFile:
+                json.dump({'pricingRules': pricingRules, 'deliveryRules': {'standard': 3, 'freeThreshold': 50}}, rulesFile)
+            # an edit that keeps the size and modification time must still be seen
+            os.utime(rulesPath, ns=(modified, modified))
+            self.assertEqual(os.stat(rulesPath).st_size, size)
+            registry = RulesRegistry(ruleSetSources, 4, rulesDirectory)
+            self.assertEqual(LoadSnapshot(path, registry), ['default', 'alt'])
+            self.assertEqual(registry.Get('shop').deliveryRules['standard'], 3)
+            self.assertEqual(LoadSnapshot(path, RulesRegistry({}, 4)), [])
+            # copying a file without changing it, as building a slug does, keeps the snapshot usable
+            SnapshotBuilder(RulesRegistry(ruleSetSources, 4, rulesDirectory)).Build(path)
+            os.utime(rulesPath, ns=(0, 0))
+            self.assertEqual(LoadSnapshot(path, RulesRegistry(ruleSetSources, 4, rulesDirectory)), ['default', 'alt', 'shop'])
+
+    def test_unloadable_rule_sets_skipped(self):
+        """
+        Tests that rules files with unusable names are not listed and
+        that malformed ones are skipped by the build and reported.
+        """
+        with tempfile.TemporaryDirectory() as rulesDirectory:
+            for fileName in ('shop.v2.json', 'broken.json'):
+                with open(os.path.join(rulesDirectory, fileName), 'w') as rulesFile:
+                    rulesFile.write('{"pricingRules": ')
+            registry = RulesRegistry(ruleSetSources, 4, rulesDirectory)
+            self.assertEqual(registry.Known(), ['default', 'alt', 'broken'])
+            builder = SnapshotBuilder(registry)
+            self.assertEqual(builder.Build(os.path.join(rulesDirectory, 'pricing.snapshot')), ['default', 'alt'])
+            self.assertEqual(list(builder.skipped), ['broken'])
+
+class EngineFuzzTest(unittest.TestCase):
+    def test_engines_agree(self):
+        """
+        Tests that every engine agrees with the reference classes on
+        random rule sets and baskets.
+        """
+        self.assertEqual(engine_fuzz.DifferentialFuzzer('unittest', 2000, 12).Run(60), [])
+
+    def test_type_strict_comparison(self):
+        """
+        Tests that responses only agree when their values have the same
+        types, with nan agreeing with nan.
+        """
+        res = {'Total': 1, 'Basket': {'A': {'unitPrice': True}}}
+        self.assertEqual(Comparable(res), Comparable({'Total': 1, 'Basket': {'A': {'unitPrice': True}}}))
+        self.assertNotEqual(Comparable(res), Comparable({'Total': 1, 'Basket': {'A': {'unitPrice': 1}}}))
+        self.assertNotEqual(Comparable(res), Comparable({'Total': 1.0, 'Basket': {'A': {'unitPrice': True}}}))
+        self.assertEqual(Comparable({'Total': float('nan')}), Comparable({'Total': float('nan')}))
+
+    def test_disagreement_reported(self):
+        """
+        Tests that an engine that disagrees with the reference classes is
+        reported with the case that reproduces it.
+        """
+        def brokenEngine(ruleSet, quantities):
+            res = engine_fuzz.engines['compiled'](ruleSet, quantities)
+            res['Total'] += 1
+            return res
+        engine_fuzz.engines['broken'] = brokenEngine
+        try:
+            mismatches = engine_fuzz.DifferentialFuzzer('unittest', 100, 5, ['broken']).Run(5)
+        finally:
+            del engine_fuzz.engines['broken']
+        self.assertTrue(mismatches)
+        self.assertEqual(mismatches[0]['engine'], 'broken')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,195 @@
+import struct
+from itertools import chain, repeat
+
+from utils import errors
+
+# content types of packed request and response bodies
+basketContentType = 'application/x-unidays-basket'
+totalsContentType = 'application/x-unidays-totals'
+
+# magic bytes and format version at the start of every packed body
+_basketMagic = b'UDB\x02'
+_totalsMagic = b'UDR\x03'
+
+# fixed-size headers: magic and item count for baskets, magic, line count and error count for totals
+_basketHeader = struct.Struct('<4sI')
+_totalsHeader = struct.Struct('<4sII')
+
+# separate the item names, ruleset id and error codes in the text block at the end of a body
+_itemSeparator = '\x00'
+_codeSeparator = '\x01'
+
+# tag and 8-byte struct code of each amount type in a totals body, where None has no value
+_amountCodes = {
+    int: (0, 'q'),
+    float: (1, 'd'),
+    type(None): (2, '8x'),
+    bool: (3, '?7x'),
+}
+_noAmount = _amountCodes[type(None)][0]
+_amountTagCodes = {tag: code for tag, code in _amountCodes.values()}
+
+class WireFormatError(ValueError):
+    """
+    Raised when a packed body is malformed or a value cannot be packed.
+    """
+
+class PackedBasket:
+    def __init__(self, rulesetId, quantities):
+        # ==== PUBLIC PROPERTIES ====
+        # None when the caller did not name a ruleset
+        self.rulesetId = rulesetId
+        self.quantities = quantities
+
+    # ==== PUBLIC METHODS ====
+    def Items(self):
+        """
+        Returns the basket's items one unit at a time without building
+        the full list of items.
+        """
+        return chain.from_iterable(repeat(item, quantity) for item, quantity in self.quantities.items())
+
+def _Text(strings):
+    """
+    Joins strings into the UTF-8 text block of a body.
+    """
+    text = _itemSeparator.join(strings)
+    if strings and text.count(_itemSeparator) != len(strings) - 1:
+        raise WireFormatError('Cannot pack strings that contain a separator.')
+    return text.encode('utf-8')
+
+def _ReadText(payload, offset, count):
+    """
+    Splits the text block at the end of a body into its strings.
+    """
+    if count == 0:
+        if len(payload) != offset:
+            raise WireFormatError('Packed body has trailing bytes.')
+        return []
+    try:
+        strings = payload[offset:].decode('utf-8').split(_itemSeparator)
+    except UnicodeDecodeError:
+        raise WireFormatError('Packed body contains an invalid string.')
+    if len(strings) != count:
+        raise WireFormatError('Packed body has the wrong number of strings.')
+    return strings
+
+def _Unpack(layout, payload, offset):
+    """
+    Unpacks a struct layout from a body, raising WireFormatError for
+    bodies that are too short.
+    """
+    try:
+        return layout.unpack_from(payload, offset)
+    except struct.error:
+        raise WireFormatError('Packed body ended early.')
+
+def EncodeBasket(quantities, rulesetId=None):
+    """
+    Packs item quantities and an optional ruleset id into a basket body:
+    a fixed header, the quantities as uint32s and a text block holding
+    the ruleset id and item names.
+    """
+    try:
+        return b''.join((
+            _basketHeader.pack(_basketMagic, len(quantities)),
+            struct.pack('<{}I'.format(len(quantities)), *quantities.values()),
+            _Text([rulesetId or ''] + list(quantities))
+        ))
+    except struct.error as error:
+        raise WireFormatError('Cannot pack quantities: {}.'.format(error))
+
+def DecodeBasket(payload):
+    """
+    Unpacks a basket body, capitalizing items as the JSON path does and
+    summing the quantities of repeated items.
+    """
+    magic, count = _Unpack(_basketHeader, payload, 0)
+    if magic != _basketMagic:
+        raise WireFormatError('Unrecognised packed body header.')
+    if _basketHeader.size + 4 * count > len(payload):
+        raise WireFormatError('Packed body ended early.')
+    counts = _Unpack(struct.Struct('<{}I'.format(count)), payload, _basketHeader.size)
+    strings = _ReadText(payload, _basketHeader.size + 4 * count, count + 1)
+    items = _itemSeparator.join(strings[1:]).upper().split(_itemSeparator) if count else []
+    if '' in items:
+        raise WireFormatError('Packed body contains an empty item.')
+    quantities = dict(zip(items, counts))
+    if len(quantities) != count:
+        quantities = {}
+        for item, quantity in zip(items, counts):
+            quantities[item] = quantities.get(item, 0) + quantity
+    return PackedBasket(strings[0] or None, quantities)
+
+def EncodeTotals(res):
+    """
+    Packs a pricing response into a totals body: a fixed header, a tag
+    for each amount, the amounts as 8-byte values, the line quantities
+    as uint32s and a text block holding the item names and error codes.
+    Errors are sent as their error codes only.
+    """
+    lines = res['Basket']
+    itemErrors = res.get('Errors', {})
+    amounts = [res['Total'], res['Savings'], res['DeliveryCharge']]
+    for line in lines.values():
+        amounts += [line['unitPrice'], line['itemSavings'], line['finalCost']]
+    for amount in amounts:
+        if type(amount) not in _amountCodes:
+            raise WireFormatError('Cannot pack {!r} as an amount.'.format(amount))
+    tags, codes = zip(*[_amountCodes[type(amount)] for amount in amounts])
+    strings = list(lines)
+    for item, errorLog in itemErrors.items():
+        entry = _codeSeparator.join([item] + list(errorLog))
+        if entry.count(_codeSeparator) != len(errorLog):
+            raise WireFormatError('Cannot pack error codes that contain a separator.')
+        strings.append(entry)
+    try:
+        return b''.join((
+            _totalsHeader.pack(_totalsMagic, len(lines), len(itemErrors)),
+            bytes(tags),
+            struct.pack('<' + ''.join(codes), *[amount for amount in amounts if amount is not None]),
+            struct.pack('<{}I'.format(len(lines)), *[line['quantity'] for line in lines.values()]),
+            _Text(strings)
+        ))
+    except struct.error as error:
+        raise WireFormatError('Cannot pack totals: {}.'.format(error))
+
+def DecodeTotals(payload):
+    """
+    Unpacks a totals body into the same structure as the JSON response,
+    restoring error messages from their codes.
+    """
+    magic, lineCount, errorCount = _Unpack(_totalsHeader, payload, 0)
+    if magic != _totalsMagic:
+        raise WireFormatError('Unrecognised packed body header.')
+    offset = _totalsHeader.size
+    tags = payload[offset:offset + 3 + 3 * lineCount]
+    if len(tags) != 3 + 3 * lineCount:
+        raise WireFormatError('Packed body ended early.')
+    offset += len(tags)
+    try:
+        layout = struct.Struct('<' + ''.join(_amountTagCodes[tag] for tag in tags))
+    except KeyError:
+        raise WireFormatError('Unknown amount tag in packed body.')
+    amounts = list(_Unpack(layout, payload, offset))
+    offset += layout.size
+    # None has no value in the body, so put it back in its place
+    if _noAmount in tags:
+        values = iter(amounts)
+        amounts = [None if tag == _noAmount else next(values) for tag in tags]
+    quantities = _Unpack(struct.Struct('<{}I'.format(lineCount)), payload, offset)
+    strings = _ReadText(payload, offset + 4 * lineCount, lineCount + errorCount)
+    res = {'Total': amounts[0], 'Savings': amounts[1], 'DeliveryCharge': amounts[2], 'Basket': {}}
+    for index, item in enumerate(strings[:lineCount]):
+        res['Basket'][item] = {
+            'quantity': quantities[index],
+            'unitPrice': amounts[3 + 3 * index],
+            'itemSavings': amounts[4 + 3 * index],
+            'finalCost': amounts[5 + 3 * index]
+        }
+    if errorCount:
+        res['Errors'] = {}
+        for entry in strings[lineCount:]:
+            errorCodes = entry.split(_codeSeparator)
+            res['Errors'][errorCodes[0]] = {errorCode: errors.get(errorCode, errorCode) for errorCode in errorCodes[1:]}
+    return res
@@ -0,0 +1,105 @@
+"""
+Compares the cost of the JSON and packed wire formats for '/price' calls.
+
+Usage:
+    python3 wire_benchmark.py            encoding and decoding only
+    python3 wire_benchmark.py <baseUrl>  also times round trips to a server
+"""
+import json
+import sys
+import timeit
+from urllib.request import Request, urlopen
+
+from config import pricingRules, deliveryRules
+from unidays import UnidaysDiscountChallenge
+from unidays_run import RunUnidays
+from wire import EncodeBasket, DecodeBasket, EncodeTotals, DecodeTotals
+from wire_client import PricingClient
+
+# baskets of increasing size to compare the formats on
+baskets = {
+    'small': 'ABBCCCDDEEZ',
+    'medium': 'ABBCCCDDEE' * 10,
+    'large': 'ABBCCCDDEE' * 1000,
+}
+
+class WireBenchmark:
+    def __init__(self, items, repeats):
+        # ==== PROTECTED PROPERTIES ====
+        self._items = items
+        self._repeats = repeats
+        self._quantities = {}
+        for item in items:
+            self._quantities[item] = self._quantities.get(item, 0) + 1
+        self._res = RunUnidays(UnidaysDiscountChallenge(pricingRules, deliveryRules), list(items)).All()
+
+    # ==== PROTECTED METHODS ====
+    def _Time(self, call):
+        """
+        Returns the mean time of a call in microseconds.
+        """
+        return timeit.timeit(call, number=self._repeats) / self._repeats * 1e6
+
+    def _JsonRequest(self):
+        """
+        Returns the basket as a JSON body holding the same tallied
+        quantities as the packed body, so that only the formats differ.
+        """
+        return json.dumps({'ruleset': 'default', 'quantities': self._quantities}).encode('utf-8')
+
+    def _JsonCodec(self):
+        """
+        Encodes and decodes the request and response as JSON, capitalizing
+        items as the packed decoder does.
+        """
+        request = json.loads(self._JsonRequest())
+        {item.upper(): quantity for item, quantity in request['quantities'].items()}
+        json.loads(json.dumps(self._res).encode('utf-8'))
+
+    def _PackedCodec(self):
+        """
+        Encodes and decodes the request and response in the packed format.
+        """
+        DecodeBasket(EncodeBasket(self._quantities, 'default'))
+        DecodeTotals(EncodeTotals(self._res))
+
+    # ==== PUBLIC METHODS ====
+    def Codec(self):
+        """
+        Returns the mean codec time and body sizes of each format.
+        """
+        # body sizes are worked out outside the timed calls
+        jsonSizes = (len(self._JsonRequest()), len(json.dumps(self._res).encode('utf-8')))
+        packedSizes = (len(EncodeBasket(self._quantities, 'default')), len(EncodeTotals(self._res)))
+        return {
+            'json': (self._Time(self._JsonCodec),) + jsonSizes,
+            'packed': (self._Time(self._PackedCodec),) + packedSizes
+        }
+
+    def RoundTrip(self, baseUrl):
+        """
+        Returns the mean round trip time of each format against a server.
+        """
+        client = PricingClient(baseUrl)
+        body = json.dumps({'items': self._items}).encode('utf-8')
+        def jsonCall():
+            request = Request(baseUrl.rstrip('/') + '/price', data=body, headers={'Content-Type': 'application/json'})
+            with urlopen(request) as response:
+                json.loads(response.read())
+        return {
+            'json': self._Time(jsonCall),
+            'packed': self._Time(lambda: client.Price(self._quantities))
+        }
+
+if __name__ == '__main__':
+    baseUrl = sys.argv[1] if len(sys.argv) > 1 else None
+    for name, items in baskets.items():
+        benchmark = WireBenchmark(items, 2000 if name != 'large' else 200)
+        codec = benchmark.Codec()
+        for wireFormat in ('json', 'packed'):
+            micros, requestBytes, responseBytes = codec[wireFormat]
+            print('{:<7} {:<7} codec {:>9.1f}us  request {:>6}B  response {:>5}B'.format(name, wireFormat, micros, requestBytes, responseBytes))
+        if baseUrl:
+            roundTrip = benchmark.RoundTrip(baseUrl)
+            for wireFormat in ('json', 'packed'):
+                print('{:<7} {:<7} round trip {:>9.1f}us'.format(name, wireFormat, roundTrip[wireFormat]))
@@ -0,0 +1,53 @@
+import json
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from wire import EncodeBasket, DecodeTotals, basketContentType
+
+class PricingError(Exception):
+    """
+    Raised when the pricing API rejects a packed request.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class PricingClient:
+    def __init__(self, baseUrl, timeout=10):
+        # ==== PROTECTED PROPERTIES ====
+        self._url = baseUrl.rstrip('/') + '/price/packed'
+        self._timeout = timeout
+
+    # ==== PROTECTED METHODS ====
+    def _Tally(self, items):
+        """
+        Counts the items in an item string or list, capitalizing them in
+        the same way as the JSON endpoint.
+        """
+        quantities = {}
+        for item in items:
+            item = str(item).upper()
+            quantities[item] = quantities.get(item, 0) + 1
+        return quantities
+
+    # ==== PUBLIC METHODS ====
+    def Price(self, items, rulesetId=None, engine=None):
+        """
+        Prices a basket given as an item string, a list of items or a
+        mapping of items to quantities. Returns the same structure as
+        the JSON '/price' endpoint.
+        """
+        quantities = items if isinstance(items, dict) else self._Tally(items)
+        url = self._url + ('?' + urlencode({'engine': engine}) if engine else '')
+        request = Request(url, data=EncodeBasket(quantities, rulesetId), headers={'Content-Type': basketContentType})
+        try:
+            with urlopen(request, timeout=self._timeout) as response:
+                return DecodeTotals(response.read())
+        except HTTPError as error:
+            # error responses keep the JSON body used by the other endpoints
+            try:
+                message = json.loads(error.read().decode('utf-8'))['Message']
+            except (ValueError, KeyError):
+                message = error.reason
+            raise PricingError(error.code, message)